@@ -0,0 +1,164 @@
+import pandas as pd
+from src.data_analysis import data_analysis, data_analysis_subtasks, data_load
+
+# Default number of rows of ViewingActivity.csv read at once.
+CHUNK_SIZE = 100000
+# Columns are read as strings, categories of categorical columns would be different in every chunk.
+CHUNK_DTYPES = {column: str for column in data_load.USED_COLUMNS}
+HOURS = list(range(24))
+
+
+class ViewingAggregates:
+    """ Partial aggregates of prepared viewing data (see prepare_data) of all profiles. Aggregates of parts of data are
+        merged by merge, results of merged aggregates are same as results of analysis of all data in one dataframe.
+        Attributes:
+            self.profiles = dataframe indexed by Profile Name with columns Duration (sum), Count and Max (the longest
+                            session)
+            self.days = series indexed by (Profile Name, Date) with sum of Duration in day
+            self.countries = dataframe indexed by (Profile Name, Country) with columns Duration and Times watched
+            self.hours = dataframe indexed by Profile Name with minutes watched in hours 0 - 23 (columns)
+    """
+
+    def __init__(self, profiles: pd.DataFrame, days: pd.Series, countries: pd.DataFrame, hours: pd.DataFrame):
+        self.profiles = profiles
+        self.days = days
+        self.countries = countries
+        self.hours = hours
+
+    @classmethod
+    def from_data(cls, data: pd.DataFrame):
+        """
+        Returns aggregates of prepared viewing data.
+        """
+        data = data_analysis_subtasks.add_time_features(data)
+        by_profile = data.groupby('Profile Name', observed=True)
+        durations = by_profile.Duration
+        profiles = pd.DataFrame({'Duration': durations.sum(), 'Count': durations.count(), 'Max': durations.max()})
+        days = data.groupby(['Profile Name', 'Date'], observed=True).Duration.sum()
+        grouped = data.groupby(['Profile Name', 'Country'], observed=True).Duration
+        countries = pd.DataFrame({'Duration': grouped.sum(), 'Times watched': grouped.count()})
+        tables = {name: data_analysis_subtasks.get_time_table(group)['Time In Minutes'].values
+                  for name, group in by_profile}
+        hours = pd.DataFrame(list(tables.values()), index=pd.Index(list(tables), name='Profile Name'),
+                             columns=HOURS, dtype=float)
+        return cls(profiles, days, countries, hours)
+
+    def merge(self, other):
+        """
+        Returns aggregates of data of self and other, they have to be aggregates of different viewings.
+        """
+        profiles = pd.concat([self.profiles, other.profiles]).groupby(level=0).agg(
+            {'Duration': 'sum', 'Count': 'sum', 'Max': 'max'})
+        days = pd.concat([self.days, other.days]).groupby(level=[0, 1]).sum()
+        countries = pd.concat([self.countries, other.countries]).groupby(level=[0, 1]).agg(
+            {'Duration': 'sum', 'Times watched': 'sum'})
+        hours = pd.concat([self.hours, other.hours]).groupby(level=0).sum()
+        return ViewingAggregates(profiles, days, countries, hours)
+
+    def users(self):
+        """
+        Returns names of all profiles.
+        """
+        return list(self.profiles.index)
+
+    def position_in_family_watching(self, name: str):
+        """
+        Returns position of profile in family by the most time spent watching, same as position_in_family_watching.
+        """
+        return data_analysis_subtasks.position_in_family_watching(self.profiles.reset_index(), name)
+
+    def hours_watched(self, name: str):
+        """
+        Returns pd.Timedelta of all time profile spent watching.
+        """
+        return self.profiles.loc[name, 'Duration']
+
+    def times_watched(self, name: str):
+        """
+        Returns how many times profile started watching.
+        """
+        return int(self.profiles.loc[name, 'Count'])
+
+    def avarage_time_spent_watching(self, name: str):
+        """
+        Returns average time of session of profile in hours (float), same as avarage_time_spent_watching.
+        """
+        return data_analysis_subtasks.transform_to_hours(self.hours_watched(name)) / self.times_watched(name)
+
+    def max_time_watched_session(self, name: str):
+        """
+        Returns pd.Timedelta of the longest session of profile.
+        """
+        return self.profiles.loc[name, 'Max']
+
+    def daily(self, name: str):
+        """
+        Returns dataframe with one row for every day profile watched, columns Start Time (midnight of the day) and
+        Duration (sum of day). Functions aggregating by days, weekdays or months give same results for it as for
+        all viewings of profile.
+        """
+        days = self.days.loc[name]
+        return pd.DataFrame({'Start Time': pd.to_datetime(pd.Series(days.index)), 'Duration': days.values})
+
+    def max_time_watched_day(self, name: str):
+        """
+        Returns pd.Timedelta of maximum time profile spent watching in one day.
+        """
+        return data_analysis.max_time_watched_day(self.daily(name))
+
+    def watching_habit_days(self, name: str):
+        """
+        Returns same dataframe as watching_habit_days for all viewings of profile.
+        """
+        return data_analysis.watching_habit_days(self.daily(name))
+
+    def watching_habit_months(self, name: str):
+        """
+        Returns same dataframe as watching_habit_months for all viewings of profile.
+        """
+        return data_analysis.watching_habit_months(self.daily(name))
+
+    def watching_habit_timeline(self, name: str):
+        """
+        Returns same dataframe as watching_habit_timeline for all viewings of profile.
+        """
+        return data_analysis.watching_habit_timeline(self.daily(name))
+
+    def get_time_table(self, name: str):
+        """
+        Returns same dataframe as get_time_table (columns Hour, Time In Minutes) for all viewings of profile.
+        """
+        return pd.DataFrame({'Hour': HOURS, 'Time In Minutes': self.hours.loc[name].values})
+
+    def analyze_country(self, name: str):
+        """
+        Returns same dataframe as analyze_country with column Country for all viewings of profile.
+        """
+        countries = self.countries.loc[name].sort_index()
+        countries.index.name = 'Country'
+        return countries
+
+
+def read_chunks(file, chunk_size: int = CHUNK_SIZE):
+    """
+    Reads used columns of ViewingActivity.csv (path or file object) by chunks of chunk_size rows.
+    Returns generator of dataframes
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    with pd.read_csv(file, usecols=data_load.USED_COLUMNS, dtype=CHUNK_DTYPES, chunksize=chunk_size) as reader:
+        yield from reader
+
+
+def aggregate_viewing_activity(files: list, chunk_size: int = CHUNK_SIZE):
+    """
+    Computes aggregates of viewing activity from ViewingActivity.csv files without loading them whole, only one chunk
+    of chunk_size rows and aggregates are in memory at once. Viewings that are in more files are counted more times.
+    Returns ViewingAggregates, None if no rows were read
+    """
+    aggregates = None
+    for file in files:
+        for chunk in read_chunks(file, chunk_size):
+            part = ViewingAggregates.from_data(data_analysis.prepare_data(chunk))
+            aggregates = part if aggregates is None else aggregates.merge(part)
+    return aggregates
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from src.data_analysis import data_analysis_subtasks
+
+# Text columns of viewing and scraped data, their values repeat a lot, so they are kept as categoricals.
+TEXT_COLUMNS = ['Profile Name', 'Title', 'Split Title', 'Country', 'Genre', 'Country From', 'Actors']
+# Integer columns and the smallest types their values fit in.
+INTEGER_COLUMNS = {'Year Start': np.int16, 'Year End': np.int16, 'Rating': np.int8, 'Year': np.int16,
+                   'Month': np.int8, 'Weekday': np.int8, 'Hour': np.int8, 'Second Of Day': np.int32}
+# Columns that are dropped, they can be derived from Start Time again (see add_time_features).
+DERIVED_COLUMNS = ['Date']
+
+
+def compact(data: pd.DataFrame):
+    """
+    Returns data in compact form for keeping in memory - text columns are categorical, Duration is replaced by
+    Duration Seconds (int32), years, rating and parts of date are small integers and Date column is dropped.
+    Original columns and types are saved in attrs of returned dataframe, expand returns data to original form.
+    """
+    result = data.drop(columns=[column for column in DERIVED_COLUMNS if column in data.columns])
+    result.attrs['expanded_columns'] = list(data.columns)
+    result.attrs['expanded_dtypes'] = dict(data.dtypes.items())
+    for column in TEXT_COLUMNS:
+        if column in result.columns and result[column].dtype != 'category':
+            result[column] = result[column].astype('category')
+    for column, dtype in INTEGER_COLUMNS.items():
+        if column in result.columns:
+            result[column] = result[column].astype(dtype)
+    if 'Duration' in result.columns:
+        seconds = (result['Duration'].values.astype('timedelta64[s]')).astype(np.int32)
+        result.insert(result.columns.get_loc('Duration'), 'Duration Seconds', seconds)
+        result = result.drop(columns='Duration')
+    return result
+
+
+def expand(data: pd.DataFrame):
+    """
+    Returns data from compact form back in form used by analysis (same columns and types as data given to compact).
+    """
+    dtypes = data.attrs.get('expanded_dtypes', {})
+    result = data.copy()
+    if 'Duration Seconds' in result.columns:
+        result.insert(result.columns.get_loc('Duration Seconds'), 'Duration',
+                      pd.to_timedelta(result['Duration Seconds'].astype(np.int64), unit='s'))
+        result = result.drop(columns='Duration Seconds')
+    for column in TEXT_COLUMNS:
+        if column in result.columns and dtypes.get(column, 'object') != 'category':
+            result[column] = result[column].astype(dtypes.get(column, object))
+    for column in INTEGER_COLUMNS:
+        if column in result.columns:
+            result[column] = result[column].astype(dtypes.get(column, 'int64'))
+    if 'Start Time' in result.columns:
+        result = data_analysis_subtasks.add_time_features(result)
+    columns = data.attrs.get('expanded_columns')
+    if columns is not None:
+        result = result[columns]
+    result.attrs = {}
+    return result
+
+
+def memory_report(data: pd.DataFrame):
+    """
+    Returns dataframe with columns Column, Type, Bytes (memory used by column with its values) sorted from the
+    largest column, last row Total has memory used by whole dataframe.
+    """
+    usage = data.memory_usage(deep=True)
+    report = pd.DataFrame({'Column': usage.index, 'Type': [str(data[column].dtype) if column in data.columns else ''
+                                                           for column in usage.index],
+                           'Bytes': usage.values})
+    report = report.sort_values('Bytes', ascending=False, kind='stable').reset_index(drop=True)
+    total = pd.DataFrame({'Column': ['Total'], 'Type': [''], 'Bytes': [int(usage.sum())]})
+    return pd.concat([report, total], ignore_index=True)
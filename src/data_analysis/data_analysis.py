@@ -1,3 +1,7 @@
+import hashlib
+import os
+import tempfile
+import threading
 import pandas as pd
 import numpy as np
 import pathlib
@@ -6,7 +10,10 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import src.scraper.scrape_data
-from src.data_analysis import data_analysis_subtasks
+import src.scraper.metadata_store
+import src.scraper.jobs
+import src.scraper.providers
+from src.data_analysis import data_analysis_subtasks, compact
 
 
 
@@ -41,10 +48,7 @@ def max_time_watched_session(data: pd.DataFrame):
 
 def max_time_watched_day(data: pd.DataFrame):
     '''Return from data maximum time spent watching in one day.'''
-    tmp = data.copy()
-    tmp['Start Time'] = tmp['Start Time'].apply(data_analysis_subtasks.select_date)
-    tmp = tmp.groupby('Start Time').Duration.sum()
-    return tmp.max()
+    return data_analysis_subtasks.add_time_features(data).groupby('Date').Duration.sum().max()
 
 
 def graph_time(data: pd.DataFrame):
@@ -73,7 +77,6 @@ def analyse_country_data(data: pd.DataFrame, all: bool = True):
         data_analysis_subtasks.markdown_graph_title('Countries streamed from with timeline')
         st.write("With double click you can show only one country. With one click you add/remove country.")
         data_analysis_subtasks.graph_history_country(tmp)
-        tmp['Start Time'] = tmp['Start Time'].apply(data_analysis_subtasks.select_date)
         df = analyze_country(tmp, 'Country')
         df['Duration'] = df['Duration'].apply(str)
         data_analysis_subtasks.markdown_graph_title('Countries streamed from (table view)')
@@ -90,9 +93,10 @@ def analyze_country(data: pd.DataFrame, column: str):
     Return dataframe - table with time spent watching - duration and how many times user started watching based on given column in
     given dataframe.
     """
-    countries_sum = data.groupby([data[column]]).Duration.sum()
-    countries_count = data.groupby([column]).Duration.count()
-    return pd.concat([countries_sum, countries_count], axis=1, keys=['Duration', 'Times watched'])
+    countries_sum = data.groupby([data[column]], observed=True).Duration.sum()
+    countries_count = data.groupby([column], observed=True).Duration.count()
+    # groups of categorical column are not sorted with observed=True
+    return pd.concat([countries_sum, countries_count], axis=1, keys=['Duration', 'Times watched']).sort_index()
 
 
 def watching_habits(data: pd.DataFrame):
@@ -120,16 +124,14 @@ def watching_habit_months(df: pd.DataFrame):
     spends time watching during months of the year - usual average.
     Returns dataframe
     """
-    data = df.copy()
+    data = data_analysis_subtasks.add_time_features(df)
     name_cat = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
                 'September', 'October', 'November', 'December']
     name_of_month = {1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'June',
                      7: 'July', 8: 'August', 9: 'September', 10: 'October', 11: 'November', 12: 'December'}
-    data['Start Time'] = data['Start Time'].apply(data_analysis_subtasks.select_month).map(name_of_month)
-    data = data.rename(columns={'Start Time': "Month"})
-    data = pd.DataFrame({'Duration': data.groupby('Month').Duration.sum().reindex(name_cat)})
+    data = pd.DataFrame({'Duration': data.groupby(data['Month'].map(name_of_month)).Duration.sum().reindex(name_cat)})
     data['Duration'] = data['Duration'].fillna(pd.to_timedelta('00:00:00'))
-    data['Time In Hours'] = data.Duration.apply(data_analysis_subtasks.transform_to_hours)
+    data['Time In Hours'] = data_analysis_subtasks.durations_to_hours(data.Duration)
     data['Percent'] = round(data['Time In Hours'] / data['Time In Hours'].sum() * 100, 1)
     data['Percent'] = data['Percent'].apply(str) + "%"
     data['Time In Hours'] = round(data['Time In Hours'], 2)
@@ -142,12 +144,10 @@ def watching_habit_timeline(df: pd.DataFrame):
      how user watched Netflix since subscription.
      returns dataframe
     """
-    data = df.copy()
-    data['Start Time'] = data['Start Time'].apply(data_analysis_subtasks.select_date)
-    data = data.rename(columns={'Start Time': "Date"})
+    data = data_analysis_subtasks.add_time_features(df)
     data = pd.DataFrame({'Duration': data.groupby('Date').Duration.sum()})
     data['Duration'] = data['Duration'].fillna(pd.to_timedelta('00:00:00'))
-    data['Time In Hours'] = data.Duration.apply(data_analysis_subtasks.transform_to_hours)
+    data['Time In Hours'] = data_analysis_subtasks.durations_to_hours(data.Duration)
     data['Percent'] = round(data['Time In Hours'] / data['Time In Hours'].sum() * 100, 1)
     data['Percent'] = data['Percent'].apply(str) + "%"
     data['Time In Hours'] = round(data['Time In Hours'], 2)
@@ -160,15 +160,13 @@ def watching_habit_days(df: pd.DataFrame):
     (Float in hours), Percent that tells when user spends time watching during week - usual average.
     returns dataframe
     """
-    data = df.copy()
+    data = data_analysis_subtasks.add_time_features(df)
     name_cat = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
     name_of_day = {0: 'Monday', 1: 'Tuesday', 2: 'Wednesday', 3: 'Thursday', 4: 'Friday', 5: 'Saturday',
                    6: 'Sunday'}
-    data['Start Time'] = data['Start Time'].apply(data_analysis_subtasks.select_dayofweek).map(name_of_day)
-    data = data.rename(columns={'Start Time': "Weekday"})
-    data = pd.DataFrame({'Duration': data.groupby('Weekday').Duration.sum().reindex(name_cat)})
+    data = pd.DataFrame({'Duration': data.groupby(data['Weekday'].map(name_of_day)).Duration.sum().reindex(name_cat)})
     data['Duration'] = data['Duration'].fillna(pd.to_timedelta('00:00:00'))
-    data['Time In Hours'] = data.Duration.apply(data_analysis_subtasks.transform_to_hours)
+    data['Time In Hours'] = data_analysis_subtasks.durations_to_hours(data.Duration)
     data['Percent'] = round(data['Time In Hours'] / data['Time In Hours'].sum() * 100, 1)
     data['Percent'] = data['Percent'].apply(str) + "%"
     data['Time In Hours'] = round(data['Time In Hours'], 2)
@@ -255,16 +253,18 @@ def analyze_years_series(data: pd.DataFrame):
     st.plotly_chart(fig)
 
 
-@st.cache(suppress_st_warning=True, show_spinner=False)
 def prepare_data(data):
     """
-    Prepares data for analysis. Filters data and drops not used columns and makes pd.Timedelta from Start Time column.
+    Prepares data for analysis. Filters data and drops not used columns (if data were read with them), makes
+    pd.Timedelta from Duration column and datetime from Start Time column and adds columns Date, Year, Month, Weekday
+    and Hour derived from it (see add_time_features), so other functions don't have to parse them again.
     """
-    data = data.drop(['Attributes', 'Supplemental Video Type', 'Device Type', 'Bookmark', 'Latest Bookmark'], axis=1)
-    data.Duration = data.Duration.apply(data_analysis_subtasks.make_delta)
+    data = data.drop(['Attributes', 'Supplemental Video Type', 'Device Type', 'Bookmark', 'Latest Bookmark'], axis=1,
+                     errors='ignore')
+    data['Duration'] = pd.to_timedelta(data['Duration'])
     delta = pd.Timedelta(hours=int(0), minutes=int(5), seconds=int(0))
     data = data[data.Duration > delta]
-    return data
+    return data_analysis_subtasks.add_time_features(data)
 
 
 def analyze_rating(data: pd.DataFrame):
@@ -327,16 +327,12 @@ def years_of_genre_user(df: pd.DataFrame, genre: str):
     Function that get table with columns Year, Genre watched that tells user what genres he watched over years.
     Return dataframe
     """
-    data = df.copy()
-    data['Start Time'] = data['Start Time'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M:%S').year)
-    year_start = data['Start Time'].min()
-    year_end = data['Start Time'].max()
-    years = pd.DataFrame({'Year': range(year_start, year_end + 1),
-                          'Genre watched': 0})
-    for genres, year in zip(data['Genre'], data['Start Time']):
-        if data_analysis_subtasks.is_genre_in_str(genre, genres):
-            years.loc[years.Year == year, 'Genre watched'] += 1
-    return years
+    data = data_analysis_subtasks.add_time_features(df)
+    years = range(data['Year'].min(), data['Year'].max() + 1)
+    # genres of every title are same in all its rows, so every string of genres is searched once
+    has_genre = {genres: data_analysis_subtasks.is_genre_in_str(genre, genres) for genres in data['Genre'].unique()}
+    watched = data.loc[data['Genre'].map(has_genre).astype(bool), 'Year'].value_counts()
+    return pd.DataFrame({'Year': years, 'Genre watched': watched.reindex(years, fill_value=0).values})
 
 
 def years_of_genre_graph(data: pd.DataFrame, genres: list, start_time: bool = False):
@@ -408,7 +404,7 @@ def first_watched(data):
     duration_first_title = data.loc[data['Start Time'] == first_watched_date, 'Duration'].head(1).item()
     with st.expander("First time watched"):
         data_analysis_subtasks.markdown("\tYou watched:", name_first_title)
-        data_analysis_subtasks.markdown("Date:", first_watched_date)
+        data_analysis_subtasks.markdown("Date:", str(first_watched_date))
         data_analysis_subtasks.markdown("\tDuration:", data_analysis_subtasks.print_pretty(duration_first_title))
 
 
@@ -492,9 +488,25 @@ def analyse_viewing_activity(name: str, data: pd.DataFrame, scraped_data: pd.Dat
     Main function that calls all other function for all analysis for web page.
     returns None
     """
+    analyse_basic_activity(name, data)
+    analyse_scraped_activity(scraped_data)
+
+
+def analyse_basic_activity(name: str, data: pd.DataFrame):
+    """
+    Calls analysis that don't need scraped data, so they can be shown before scraping ends.
+    returns None
+    """
     first_watched(data[data['Profile Name'] == name])
     data = analyse_overall_activity(data, name)
     watching_habits(data)
+
+
+def analyse_scraped_activity(scraped_data: pd.DataFrame):
+    """
+    Calls analysis of data with scraped data about titles.
+    returns None
+    """
     analyze_watching_titles(scraped_data)
     analyse_country_data(scraped_data)
     analyze_other(scraped_data)
@@ -502,32 +514,163 @@ def analyse_viewing_activity(name: str, data: pd.DataFrame, scraped_data: pd.Dat
     analyze_rating(scraped_data)
 
 
-@st.cache(suppress_st_warning=True, show_spinner=False)
-def add_scraped_data(data: pd.DataFrame, name: str):
+SCRAPED_COLUMNS = ['Year Start', 'Year End', 'Genre', 'Country From', 'Actors', 'Rating']
+
+
+def split_titles(data: pd.DataFrame):
+    """
+    Returns copy of data with added columns Split Title (name of series without episode) and Series (bool).
+    """
+    new_data = data.copy()
+    new_data['Split Title'] = data_analysis_subtasks.split_title_column(new_data['Title'])
+    new_data['Series'] = np.where(new_data['Title'] == new_data['Split Title'], False,
+                                  True)  # create a new column in df1 to check if prices match
+    return new_data
+
+
+def titles_metadata(data: pd.DataFrame):
+    """
+    From dataframe with scraped data (returned by add_scraped_data) returns dataframe with one row for every title and
+    columns Split Title, Series and scraped columns.
+    """
+    return data.drop_duplicates(['Split Title', 'Series'])[['Split Title', 'Series'] + SCRAPED_COLUMNS]
+
+
+def titles_by_watch_time(data: pd.DataFrame):
+    """
+    From data with columns Split Title, Series and Duration returns dataframe with columns Title, Series, Duration
+    with one row for every title, sorted from title user watched the longest.
+    """
+    titles = data.groupby(['Split Title', 'Series'], sort=False).Duration.sum().reset_index()
+    titles = titles.rename(columns={'Split Title': 'Title'})
+    return titles.sort_values('Duration', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def watch_time_coverage(data: pd.DataFrame, name: str, scraped_data: pd.DataFrame):
+    """
+    Returns float 0-1 - part of time user watched titles that have scraped data.
+    """
+    total = hours_watched(data[data['Profile Name'] == name])
+    if total == pd.Timedelta(0):
+        return 1.0
+    return hours_watched(scraped_data) / total
+
+
+def join_scraped_data(data: pd.DataFrame, name: str, metadata: pd.DataFrame):
+    """
+    Joins data of user with given name with metadata of titles (from household_metadata) and returns dataframe in format
+    of add_scraped_data. Titles without metadata are left out.
+    """
+    new_data = split_titles(data[data['Profile Name'] == name])
+    return pd.merge(new_data, metadata, on=['Split Title', 'Series'])
+
+
+# Providers are hashed by identity, st.cache looks up hash_funcs by exact type, so every provider class is listed.
+PROVIDER_HASH_FUNCS = {src.scraper.providers.CsfdProvider: id, src.scraper.providers.OfflineProvider: id}
+
+
+@st.cache(suppress_st_warning=True, show_spinner=False, hash_funcs=PROVIDER_HASH_FUNCS)
+def add_scraped_data(data: pd.DataFrame, name: str, previous: pd.DataFrame = None, time_budget: float = None,
+                     provider: src.scraper.providers.MetadataProvider = None, compact_form: bool = False):
     """
     Function that from given dataframe prepares data for scraping and calls scraping class. After that merges scraped data
     with given and return dataframe with columns: Profile Name (str), Start Time (datetime), Duration (pd.Timedelta),
     Title (str), Country(str), Split Title (str), Series (bool), Year Start (int), Year End (int), Genre (str),
     Country From (str), Actors (str), Rating (int)
-    """
-    new_data = data[data['Profile Name'] == name].copy()
-    data['Title'].count()
-    new_data['Split Title'] = new_data['Title'].apply(data_analysis_subtasks.split_title)
-    new_data['Series'] = np.where(new_data['Title'] == new_data['Split Title'], False,
-                                  True)  # create a new column in df1 to check if prices match
-    sdf = pd.DataFrame({'Title': new_data['Split Title'].copy(),
-                        'Series': new_data['Series'].copy()})
-    sdf = sdf.drop_duplicates()
-    scrape = src.scraper.scrape_data.ScrapeData(sdf)
-    sdf['Title'].count()
+    Titles of all profiles in data are scraped at once (see household_metadata), so other profile is only joined with
+    already scraped data. Metadata are taken from provider (default scraping of csfd), see household_metadata.
+    If compact_form is True, data are returned (and cached) in compact form, compact.expand returns them to this form.
+    """
+    scraped_data = join_scraped_data(data, name, household_metadata(data, previous, time_budget, provider))
+    return compact.compact(scraped_data) if compact_form else scraped_data
+
+
+@st.cache(suppress_st_warning=True, show_spinner=False, hash_funcs=PROVIDER_HASH_FUNCS)
+def household_metadata(data: pd.DataFrame, previous: pd.DataFrame = None, time_budget: float = None,
+                       provider: src.scraper.providers.MetadataProvider = None):
+    """
+    Scrapes titles watched by all profiles in data, every title only once. Returns dataframe with one row for every
+    found title and columns Split Title, Series and scraped columns.
+    If previous dataframe with scraped data (in format of add_scraped_data or of this function) is given, only titles
+    that are not in it are scraped.
+    Titles are scraped from the most watched, if time_budget (seconds) is given, scraping stops after it and rest of
+    titles is left without data.
+    Metadata are taken from provider, None - CsfdProvider scraping csfd.cz (for offline data use OfflineProvider).
+    """
+    batches = household_metadata_batches(data, previous, time_budget=time_budget, provider=provider)
+    metadata, finished, total = next(batches)
+    if finished == total:
+        return metadata
+    minutes = int(src.scraper.scrape_data.estimate_duration(total - finished) / 60 + 1)
     with st.spinner(text="If you watch a lot, this could take a while. Fetching data for you."
-                         + " This will take about: " + str(int((sdf['Title'].count() * 2.5)/60 + 1)) + " min"):
-        scrape.start_scraping()
-        scraped_data = scrape.get_scraped_data().copy()
+                         + " This will take about: " + str(minutes) + " min"):
+        for metadata, finished, total in batches:
+            pass
+    return metadata
+
+
+def household_metadata_batches(data: pd.DataFrame, previous: pd.DataFrame = None, batch_size: int = None,
+                               time_budget: float = None, provider: src.scraper.providers.MetadataProvider = None):
+    """
+    Same as household_metadata, but scraped data are returned during scraping - generator yields after every
+    batch_size (default tenth of titles, at least 10) scraped titles tuple (metadata of titles scraped so far, number
+    of scraped titles, number of all titles to scrape).
+    """
+    sdf = titles_by_watch_time(split_titles(data))
+    known = pd.DataFrame(columns=['Split Title', 'Series'] + SCRAPED_COLUMNS)
+    if previous is not None:
+        known = titles_metadata(previous)
+        sdf = sdf[~pd.MultiIndex.from_frame(sdf[['Title', 'Series']]).isin(
+            pd.MultiIndex.from_frame(known[['Split Title', 'Series']]))]
+    if sdf.empty:
+        yield known.reset_index(drop=True), 0, 0
+        return
+    if provider is None:
+        with src.scraper.providers.CsfdProvider(time_budget=time_budget) as provider:
+            yield from lookup_batches(provider, sdf, known, batch_size)
+    else:
+        yield from lookup_batches(provider, sdf, known, batch_size)
+
+
+def lookup_batches(provider: src.scraper.providers.MetadataProvider, sdf: pd.DataFrame, known: pd.DataFrame,
+                   batch_size: int = None):
+    """
+    Looks up titles of sdf (see titles_by_watch_time) by provider, yields same tuples as household_metadata_batches,
+    known metadata are added to every table.
+    """
+    for scraped_data, finished in provider.iter_lookup(sdf, batch_size or max(10, len(sdf) // 10)):
+        scraped_data.insert(1, 'Series', sdf['Series'])
         scraped_data = scraped_data[scraped_data['Year Start'] != -1]
         scraped_data = scraped_data.rename(columns={'Title': 'Split Title', 'Country': 'Country From'})
-        new_data = pd.merge(new_data, scraped_data, on='Split Title')
-    return new_data
+        if not known.empty:
+            scraped_data = pd.concat([known, scraped_data])
+        yield scraped_data.reset_index(drop=True), finished, len(sdf)
+
+
+def frame_fingerprint(data: pd.DataFrame):
+    """
+    Returns sha256 hash of values of all rows of dataframe (index is not used).
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(data, index=False).values.tobytes()).hexdigest()
+
+
+def household_metadata_job(data: pd.DataFrame, time_budget: float = None,
+                           provider: src.scraper.providers.MetadataProvider = None, restart: bool = False):
+    """
+    Starts household_metadata_batches in background worker, so it runs independently of reruns of page. Saved
+    metadata (see load_saved_metadata) are read once when job starts and only titles that aren't in them are scraped.
+    Same upload with same time_budget and provider gets the same job, so rerun only reads its progress. Job stopped
+    by time_budget is started again only if restart is True, then it scrapes titles that are still missing.
+    Returns ScrapeJob, its result is metadata in format of household_metadata in compact form (see compact.compact),
+    jobs are kept in memory of server.
+    """
+    # provider itself is in key (not its id), so id of provider that no longer exists can't match another provider
+    key = (frame_fingerprint(data[['Profile Name', 'Start Time', 'Duration', 'Title']]), time_budget, provider)
+    def batches():
+        for metadata, finished, total in household_metadata_batches(data.copy(), load_saved_metadata(),
+                                                                     time_budget=time_budget, provider=provider):
+            yield compact.compact(metadata), finished, total
+    return src.scraper.jobs.QUEUE.submit(key, batches, restart=restart)
 
 
 def analyze_other(data: pd.DataFrame):
@@ -548,4 +691,43 @@ def select_scraped_data(name):
     path_m = str(pathlib.Path().absolute()).split("/src")[0]
     scraped_data = pd.read_csv(path_m + '/tests/scraped_data/' + name + '.csv')
     scraped_data.Duration = pd.to_timedelta(scraped_data.Duration)
-    return scraped_data
+    return data_analysis_subtasks.add_time_features(scraped_data)
+
+
+def saved_metadata_path():
+    """
+    Returns path of csv where metadata of titles scraped for all profiles are saved for next upload.
+    """
+    return src.scraper.metadata_store.cache_path('titles_metadata.csv')
+
+
+def load_saved_metadata():
+    """
+    Returns metadata of titles (in same format as household_metadata) saved from last upload or None.
+    """
+    path = saved_metadata_path()
+    if not path.exists():
+        return None
+    return pd.read_csv(path, keep_default_na=False,
+                       dtype={'Split Title': str, 'Genre': str, 'Country From': str, 'Actors': str})
+
+
+# Sessions of app save metadata to same file, this lock keeps them from overwriting titles saved by each other.
+METADATA_LOCK = threading.Lock()
+
+
+def save_metadata(metadata: pd.DataFrame):
+    """
+    Saves metadata of titles, next upload (of any profile) scrapes only titles that are not in them. Metadata are
+    merged with currently saved metadata (titles saved by other sessions are kept) and file is replaced at once.
+    Returns None
+    """
+    path = saved_metadata_path()
+    with METADATA_LOCK:
+        saved = load_saved_metadata()
+        if saved is not None:
+            metadata = pd.concat([saved, metadata]).drop_duplicates(['Split Title', 'Series'], keep='last')
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix='.tmp', delete=False, encoding='utf-8',
+                                         newline='') as file:
+            metadata.to_csv(file, index=False)
+        os.replace(file.name, path)
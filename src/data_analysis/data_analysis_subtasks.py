@@ -1,28 +1,44 @@
 import math
-from datetime import datetime
 from datetime import timedelta
+import numpy as np
 import pandas as pd
 import re
 import streamlit as st
 import plotly.graph_objects as go
 
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Columns derived from Start Time by add_time_features.
+TIME_FEATURES = ['Date', 'Year', 'Month', 'Weekday', 'Hour', 'Second Of Day']
+# Hours of time table, watching after midnight of next day (up to 9 am) is added to hours of the day.
+TIME_TABLE_HOURS = 33
 
-def start_time_to_date_only(date):
+
+def to_start_time(column: pd.Series):
     """
-    Returns dataframe that modifies string date '%Y-%m-%d %H:%M:%S' for %Y-%m-%d datetime
+    Returns column Start Time as datetime64, column of strings in format '%Y-%m-%d %H:%M:%S' is parsed at once.
     """
-    tmp = date.copy()
-    tmp['Start Time'] = tmp['Start Time'].apply(select_date)
-    return tmp
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, format=TIME_FORMAT)
 
 
-def start_time_to_time_only(data: pd.DataFrame):
+def add_time_features(data: pd.DataFrame):
     """
-    Returns dataframe that modifies string date '%Y-%m-%d %H:%M:%S' for '%H:%M:%S' time part datetime
+    Returns dataframe with Start Time as datetime64 and columns Date (datetime.date), Year, Month, Weekday (0 - Monday),
+    Hour and Second Of Day derived from it. Data from prepare_data already have them and are returned without change.
     """
-    tmp = data.copy()
-    tmp['Start Time'] = tmp['Start Time'].apply(select_time)
-    return tmp
+    missing = [column for column in TIME_FEATURES if column not in data.columns]
+    if not missing and pd.api.types.is_datetime64_any_dtype(data['Start Time']):
+        return data
+    data = data.copy()
+    data['Start Time'] = to_start_time(data['Start Time'])
+    start = data['Start Time'].dt
+    features = {'Date': lambda: start.date, 'Year': lambda: start.year, 'Month': lambda: start.month,
+                'Weekday': lambda: start.weekday, 'Hour': lambda: start.hour,
+                'Second Of Day': lambda: start.hour * 3600 + start.minute * 60 + start.second}
+    for column in missing:
+        data[column] = features[column]()
+    return data
 
 
 def make_delta(entry: str):
@@ -33,34 +49,6 @@ def make_delta(entry: str):
     return pd.Timedelta(hours=int(h), minutes=int(m), seconds=int(s))
 
 
-def select_date(entry: str):
-    """
-    From given string that should be in format of %Y-%m-%d %H:%M:%S returns date part datetime %Y-%m-%d
-    """
-    return datetime.strptime(entry, '%Y-%m-%d %H:%M:%S').date()
-
-
-def select_dayofweek(entry: str):
-    """
-    From given string that should be in format of %Y-%m-%d %H:%M:%S return weekday datetime
-    """
-    return datetime.strptime(entry, '%Y-%m-%d %H:%M:%S').weekday()
-
-
-def select_month(entry: str):
-    """
-    From given string that should be in format of %Y-%m-%d %H:%M:%S returns month
-    """
-    return datetime.strptime(entry, '%Y-%m-%d %H:%M:%S').month
-
-
-def select_time(entry: str):
-    """
-    Returns datetime, from '%Y-%m-%d %H:%M:%S' string date, with '%H:%M:%S' time part
-    """
-    return datetime.strptime(entry, '%Y-%m-%d %H:%M:%S').time()
-
-
 def transform_to_hours(entry):
     """
     Transforms given pd.Timedelta to hours and returns float with hours
@@ -69,12 +57,13 @@ def transform_to_hours(entry):
     return days * 24 + hours + (min / 60) + (sec / (60 * 60))
 
 
-def transform_to_minutes(entry):
+def durations_to_hours(durations: pd.Series):
     """
-    Transforms given pd.Timedelta to minutes and returns float with minutes
+    Transforms column of pd.Timedelta to hours at once, values are same as from transform_to_hours.
+    Returns series of floats
     """
-    days, hours, min, sec, mlsec, microsec, nanosec = entry.components
-    return days * 24 * 60 + hours * 60 + min + sec / 60
+    components = durations.dt.components
+    return components.days * 24 + components.hours + (components.minutes / 60) + (components.seconds / (60 * 60))
 
 
 def get_string_values_from_dataframe(data: pd.DataFrame, column: str):
@@ -160,7 +149,7 @@ def position_in_family_watching(df: pd.DataFrame, name: str):
     Returns position in family in bz most time spent.
     Returns duration.
     """
-    profiles = df.groupby('Profile Name').Duration.sum()
+    profiles = df.groupby('Profile Name', observed=True).Duration.sum()
     profiles = profiles.sort_values(ascending=False)
     pos = 0
     for i, x in profiles.items():
@@ -188,23 +177,31 @@ def most_common_watched_titles(data: pd.DataFrame, episodes: bool, sum: bool):
      watching else on count of time spent watching. If episodes are true then name of episodes is split to have only
      name part not episode part.
     """
-    tmp = data.copy()
-    tmp['Start Time'] = tmp['Start Time'].apply(select_date)
-    tmp = tmp.drop_duplicates(['Start Time', 'Title'])
-    if episodes:
-        tmp['Title'] = tmp['Title'].apply(split_title)
+    tmp = watched_titles(data, episodes)
     if sum:
         return tmp.groupby(['Title'])['Duration'].sum().sort_values(ascending=False)
     else:
         return tmp.groupby(['Title'])['Start Time'].count().sort_values(ascending=False)
 
 
+def watched_titles(data: pd.DataFrame, episodes: bool):
+    """
+    Returns data with one row for every title watched in a day, if episodes are true then Title has only name of
+    series without episode part.
+    """
+    tmp = add_time_features(data).drop_duplicates(['Date', 'Title'])
+    if episodes:
+        tmp = tmp.assign(Title=split_title_column(tmp['Title']))
+    return tmp
+
+
 def join_most_common_watched_titles(data: pd.DataFrame, episodes=False):
     """
     Returns dataframe with most watched titles and sum of time spent watching and count of times watched.
     """
-    data1 = most_common_watched_titles(data, episodes, True)
-    data2 = most_common_watched_titles(data, episodes, False)
+    tmp = watched_titles(data, episodes)
+    data1 = tmp.groupby(['Title'])['Duration'].sum().sort_values(ascending=False)
+    data2 = tmp.groupby(['Title'])['Start Time'].count().sort_values(ascending=False)
     df = pd.merge(data1, data2, on='Title')
     df['Duration'] = df['Duration'].apply(str)
     return df
@@ -215,10 +212,9 @@ def data_country_timeline(data: pd.DataFrame, country: str):
     Returns dataframe with time spent watching in given country over years - columns: Years, Duration, Time In Hours
     """
     tmp = data[data.Country == country].groupby('Start Time').Duration.sum()
-    grouped = pd.DataFrame({'Date': tmp.index.copy(),
+    grouped = pd.DataFrame({'Date': to_start_time(pd.Series(tmp.index)).dt.date,
                             'Duration': tmp.values.copy()})
-    grouped['Time In Hours'] = round(grouped['Duration'].apply(transform_to_hours), 2)
-    grouped['Date'] = grouped['Date'].apply(select_date)
+    grouped['Time In Hours'] = round(durations_to_hours(grouped['Duration']), 2)
     return grouped
 
 
@@ -259,82 +255,48 @@ def get_rating_over_years(df: pd.DataFrame):
     Returns dataframe with columns Year and Average Rating, that tells user what was average rating over years of
     movies/series they watched.
     """
-    data = df.copy()
-    data['Start Time'] = data['Start Time'].apply(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M:%S').year)
-    year_start = data['Start Time'].min()
-    year_end = data['Start Time'].max()
-    years = pd.DataFrame({'Year': range(year_start, year_end + 1),
-                          'Rating Sum': 0,
-                          'Rating Count': 0})
-    for rating, year in zip(data['Rating'], data['Start Time']):
-        years.loc[years.Year == year, 'Rating Sum'] += rating
-        years.loc[years.Year == year, 'Rating Count'] += 1
-    years = pd.DataFrame({'Year': years['Year'],
-                          'Average Rating': round(years['Rating Sum'] / years['Rating Count'], 2)}).sort_values('Year')
-    return years
+    data = add_time_features(df)
+    years = range(data['Year'].min(), data['Year'].max() + 1)
+    ratings = data.groupby('Year').Rating.agg(['sum', 'count']).reindex(years)
+    return pd.DataFrame({'Year': years, 'Average Rating': round(ratings['sum'] / ratings['count'], 2).values})
 
 
 def get_rating_timeline(data: pd.DataFrame):
     """
     Returns dataframe with data about users watching and how was rated movies that user watched.
     """
-    df = data.copy()
-    df = start_time_to_date_only(df)
-    timeline = df.groupby(df['Start Time']).Rating.mean()
+    df = add_time_features(data)
+    timeline = df.groupby(df['Date']).Rating.mean()
     df = pd.DataFrame({'Date': timeline.index,
                        'Average Rating': timeline.values}).reset_index(drop=True)
     df['Average Rating'] = round(df['Average Rating'], 2)
     return df
 
 
-# tests in get_time_table
-def add_to_time_table(table: pd.DataFrame, row: pd.Series):
-    """
-    Add minutes data from Duration and starts time to dataframe with columns Hour, Time In Minutes that is returned.
-    """
-    hour = row[1].hour
-    minutes = row[1].minute
-    second = row[1].second
-    minutes += second / 60
-    total_min_watched = row[2]
-    if total_min_watched - (60 - minutes) < 0:
-        table.loc[(table['Hour'] == hour), 'Time In Minutes'] += total_min_watched
-        return
-    table.loc[(table['Hour'] == hour), 'Time In Minutes'] += (60 - minutes)
-    hour += 1
-    total_min_watched -= (60 - minutes)
-    hour_in_min = math.floor(total_min_watched / 60)
-    total_min_watched -= hour_in_min * 60
-    if hour_in_min != 0:
-        table.loc[(table.Hour.isin(range(hour, hour + hour_in_min))), 'Time In Minutes'] += 60
-    table.loc[(table['Hour'] == hour + hour_in_min), 'Time In Minutes'] += total_min_watched
-
-
-# tests in get_time_table
-def join_time_table(table: pd.DataFrame):
-    """
-    Dataframe modifies and returns only 24 hours with sum of minutes.
-    """
-    nmp = table['Time In Minutes'].to_numpy()
-    for i in range(0, 9):
-        nmp[i] += nmp[i + 24]
-
-
 def get_time_table(data: pd.DataFrame):
     """
-    Returns pd.Dataframe with columns Hour, Time In Minutes for overview what hour user watch how much.
-    """
-    tmp = data.copy()
-    tmp.Duration = tmp.Duration.apply(transform_to_minutes)
-    tmp['Start Time'] = tmp['Start Time'].apply(select_time)
-    table = pd.DataFrame({'Hour': range(0, 33),
-                          'Time In Minutes': 0})
-    tmp = tmp[['Start Time', 'Duration']]
-    for row in tmp.itertuples():
-        add_to_time_table(table, row)
-    join_time_table(table)
-    table = table.drop(range(24, 33))
-    return table
+    Returns pd.Dataframe with columns Hour, Time In Minutes for overview what hour user watch how much. Watching is
+    divided to hours it lasted, watching after midnight is added to early hours.
+    """
+    data = add_time_features(data)
+    start = data['Second Of Day'].to_numpy(dtype=np.int64)
+    end = start + (data['Duration'] // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+    first, last = start // 3600, end // 3600
+    # watching after the last hour of table is not counted, it goes to extra bin that is dropped
+    last_bin = np.minimum(last, TIME_TABLE_HOURS)
+    one_hour = first == last
+    seconds = np.bincount(first, np.where(one_hour, end - start, (first + 1) * 3600 - start),
+                          minlength=TIME_TABLE_HOURS + 1)
+    seconds += np.bincount(last_bin, np.where(one_hour | (last >= TIME_TABLE_HOURS), 0, end - last * 3600),
+                           minlength=TIME_TABLE_HOURS + 1)
+    # whole hours between first and last hour of watching
+    several = ~one_hour
+    whole = np.bincount(np.minimum(first[several] + 1, TIME_TABLE_HOURS), minlength=TIME_TABLE_HOURS + 1) - \
+        np.bincount(last_bin[several], minlength=TIME_TABLE_HOURS + 1)
+    seconds += np.cumsum(whole) * 3600
+    minutes = seconds[:TIME_TABLE_HOURS] / 60
+    minutes[:TIME_TABLE_HOURS - 24] += minutes[24:]
+    return pd.DataFrame({'Hour': range(0, 24), 'Time In Minutes': minutes[:24]})
 
 
 def split_title(entry):
@@ -347,3 +309,11 @@ def split_title(entry):
     if re.search(".+Episode [0-9]+.*$", arr[-1]) is not None:
         return arr[0]
     return tmp
+
+
+def split_title_column(titles: pd.Series):
+    """
+    Returns column of titles split by split_title, every distinct title is split once (episodes of series repeat a lot).
+    """
+    split = {title: split_title(title) for title in titles.unique()}
+    return titles.map(split).astype(titles.dtype if titles.dtype == 'string' else object)
@@ -1,17 +1,426 @@
+import collections
+import contextlib
 import copy
+import hashlib
+import os
 import pathlib
+import tempfile
+import threading
 import streamlit as st
 import pandas as pd
 import sys
 import re
-from src.data_analysis import data_analysis
+import zipfile
+from src.data_analysis import data_analysis, data_analysis_subtasks, compact
+from src.scraper import metadata_store
+
+try:
+    import pyarrow
+    from pyarrow import csv as pyarrow_csv
+    from pyarrow import feather
+except ImportError:
+    pyarrow = pyarrow_csv = feather = None
+
+REQUIRED_COLUMNS = {'Profile Name', 'Start Time', 'Duration', 'Attributes', 'Title', 'Supplemental Video Type',
+                    'Device Type', 'Bookmark', 'Latest Bookmark', 'Country'}
+# Only these columns are used by analysis, other columns of ViewingActivity.csv are not read.
+USED_COLUMNS = ['Profile Name', 'Start Time', 'Duration', 'Title', 'Country']
+DTYPES = {'Profile Name': 'category', 'Start Time': str, 'Duration': str, 'Title': str, 'Country': 'category'}
+CATEGORICAL_COLUMNS = [column for column, dtype in DTYPES.items() if dtype == 'category']
+# Changed when prepared data change, so uploads cached in older format are not used.
+UPLOAD_CACHE_VERSION = '2'
+# Number of uploads kept in cache, the least recently used uploads over it are deleted.
+UPLOAD_CACHE_SIZE = 20
+# Number of uploads kept in memory instead when pyarrow isn't installed and uploads can't be saved to files.
+MEMORY_UPLOADS_SIZE = 8
+VIEWING_ACTIVITY = 'CONTENT_INTERACTION/ViewingActivity.csv'
+# Type of text columns in arrow strings mode, values are kept in Arrow buffers instead of python objects.
+ARROW_STRING = 'string[pyarrow]'
+# Number of merged sets of uploads kept in memory, see merge_uploads.
+MERGED_CACHE_SIZE = 8
+# One viewing is identified by these columns, viewings of more exports with same values are the same viewing.
+KEY_COLUMNS = ['Profile Name', 'Start Time', 'Title']
+
+
+def read_header(file):
+    """
+    Returns names of columns of csv file, only first line is read and file is returned to start.
+    """
+    file.seek(0)
+    columns = pd.read_csv(file, nrows=0).columns
+    file.seek(0)
+    return columns
+
+
+def arrow_types(data_type):
+    """
+    Returns pandas type of Arrow type for pyarrow.Table.to_pandas in arrow strings mode, strings are kept in Arrow
+    buffers without copying, None for other types (default conversion).
+    """
+    return pd.StringDtype('pyarrow') if data_type in (pyarrow.string(), pyarrow.large_string()) else None
+
+
+def to_arrow_strings(data: pd.DataFrame):
+    """
+    Returns copy of data with text columns (object or categorical with strings) as Arrow-backed strings, other columns
+    are not changed. Data are returned without change if pyarrow isn't installed.
+    """
+    if pyarrow is None:
+        return data
+    data = data.copy()
+    for column in data.columns:
+        values = data[column]
+        if values.dtype == 'category':
+            values = values.cat.categories
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+            data[column] = data[column].astype(ARROW_STRING)
+    return data
+
+
+def read_viewing_activity(file, arrow_strings: bool = False):
+    """
+    Reads used columns of ViewingActivity.csv with types, Profile Name and Country are categorical (with sorted
+    categories). Multithreaded pyarrow parser is used if it is installed, otherwise pandas parser.
+    :param arrow_strings: True - all columns are Arrow-backed strings instead (only if pyarrow is installed)
+    :return: dataframe
+    """
+    file.seek(0)
+    if pyarrow_csv is None:
+        return pd.read_csv(file, usecols=USED_COLUMNS, dtype=DTYPES)
+    if arrow_strings:
+        types = {column: pyarrow.string() for column in USED_COLUMNS}
+        table = pyarrow_csv.read_csv(file, convert_options=pyarrow_csv.ConvertOptions(include_columns=USED_COLUMNS,
+                                                                                      column_types=types))
+        return table.to_pandas(types_mapper=arrow_types)
+    categorical = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    types = {column: categorical if dtype == 'category' else pyarrow.string() for column, dtype in DTYPES.items()}
+    table = pyarrow_csv.read_csv(file, convert_options=pyarrow_csv.ConvertOptions(include_columns=USED_COLUMNS,
+                                                                                  column_types=types))
+    data = table.to_pandas()
+    for column in CATEGORICAL_COLUMNS:
+        data[column] = data[column].cat.set_categories(sorted(data[column].cat.categories))
+    return data
+
+
+def upload_fingerprint(file, chunk_size: int = 1 << 20):
+    """
+    Returns sha256 hash of content of uploaded file, file is returned to start.
+    """
+    digest = hashlib.sha256(UPLOAD_CACHE_VERSION.encode())
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def cached_upload_path(fingerprint: str):
+    """
+    Returns path of feather file with prepared data of upload with given fingerprint.
+    """
+    return metadata_store.cache_path('upload-' + fingerprint + '.feather')
+
+
+def read_frame(path: pathlib.Path, arrow_strings: bool = False):
+    """
+    Returns dataframe saved by write_frame, file is memory-mapped instead of read. Returns None if file doesn't exist
+    or pyarrow isn't installed.
+    :param arrow_strings: True - string columns are Arrow-backed strings using buffers of file
+    """
+    if feather is None or not path.exists():
+        return None
+    table = feather.read_table(str(path), memory_map=True)
+    data = table.to_pandas(date_as_object=True, types_mapper=arrow_types if arrow_strings else None)
+    data = data.set_index('index')
+    data.index.name = None
+    return data
+
+
+def write_frame(path: pathlib.Path, data: pd.DataFrame):
+    """
+    Saves dataframe with its index to feather file, file is replaced at once, so it is never read half written.
+    Returns None
+    """
+    if feather is None:
+        return
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as file:
+        feather.write_feather(data.reset_index(), file)
+    os.replace(file.name, path)
+
+
+# Prepared uploads (in compact form) by fingerprint when pyarrow isn't installed, least recently used first.
+memory_uploads = collections.OrderedDict()
+MEMORY_UPLOADS_LOCK = threading.Lock()
+
+
+def load_cached_upload(fingerprint: str, arrow_strings: bool = False):
+    """
+    Returns prepared data (as returned by prepare_data) of upload saved by save_cached_upload, file is memory-mapped
+    instead of read. Without pyarrow uploads are kept in memory of server. Returns None if upload isn't saved.
+    """
+    if feather is None:
+        with MEMORY_UPLOADS_LOCK:
+            data = memory_uploads.get(fingerprint)
+            if data is not None:
+                memory_uploads.move_to_end(fingerprint)
+        return compact.expand(data) if data is not None else None
+    path = cached_upload_path(fingerprint)
+    data = read_frame(path, arrow_strings)
+    if data is not None:
+        path.touch()
+    return data
+
+
+def save_cached_upload(fingerprint: str, data: pd.DataFrame):
+    """
+    Saves prepared data of upload to feather file, next upload of same file doesn't have to be parsed. Only
+    UPLOAD_CACHE_SIZE most recently used uploads are kept. Without pyarrow MEMORY_UPLOADS_SIZE most recently used
+    uploads are kept in memory in compact form.
+    Returns None
+    """
+    if feather is None:
+        with MEMORY_UPLOADS_LOCK:
+            memory_uploads[fingerprint] = compact.compact(data)
+            memory_uploads.move_to_end(fingerprint)
+            while len(memory_uploads) > MEMORY_UPLOADS_SIZE:
+                memory_uploads.popitem(last=False)
+        return
+    write_frame(cached_upload_path(fingerprint), data)
+    evict_cached_uploads(UPLOAD_CACHE_SIZE)
+
+
+def evict_cached_uploads(size: int = UPLOAD_CACHE_SIZE):
+    """
+    Deletes cached uploads except of size most recently used (saved or loaded) ones.
+    Returns None
+    """
+    used = {}
+    for path in cached_upload_path('').parent.glob('upload-*.feather'):
+        try:
+            used[path] = path.stat().st_mtime
+        except OSError:
+            pass
+    for path in sorted(used, key=used.get, reverse=True)[size:]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def history_path(history: str):
+    """
+    Returns path of feather file with prepared viewing history of account merged from all exports uploaded with
+    merging to history with given name. Name is hashed, so it can't be read from name of file.
+    """
+    return metadata_store.cache_path('history-' + hashlib.sha256(history.encode()).hexdigest() + '.feather')
+
+
+def load_history(history: str, arrow_strings: bool = False):
+    """
+    Returns prepared viewing history with given name saved by save_history or None if nothing is saved (or pyarrow
+    isn't installed).
+    """
+    return read_frame(history_path(history), arrow_strings)
+
+
+def save_history(history: str, data: pd.DataFrame):
+    """
+    Saves prepared viewing history with given name, next export merged to the history is merged to it.
+    Returns None
+    """
+    write_frame(history_path(history), data)
+
+
+def latest_start(data: pd.DataFrame):
+    """
+    Returns Start Time of the last viewing in data (raw or prepared) as pd.Timestamp, pd.NaT for empty data.
+    """
+    if data.empty:
+        return pd.NaT
+    return pd.Timestamp(data_analysis_subtasks.to_start_time(data['Start Time']).max())
+
+
+def concat_viewing(first: pd.DataFrame, second: pd.DataFrame):
+    """
+    Returns rows of first followed by rows of second with new index, categorical columns keep being categorical with
+    sorted union of categories of both frames.
+    """
+    first, second = first.copy(), second[first.columns].copy()
+    for column in first.columns:
+        if first[column].dtype == 'category' or second[column].dtype == 'category':
+            values = pd.api.types.union_categoricals([first[column].astype('category'),
+                                                      second[column].astype('category')], sort_categories=True)
+            dtype = pd.CategoricalDtype(values.categories)
+            first[column] = first[column].astype(dtype)
+            second[column] = second[column].astype(dtype)
+    return pd.concat([first, second], ignore_index=True)
+
+
+def merge_viewing_activity(stored: pd.DataFrame, export: pd.DataFrame, append_only: bool = True):
+    """
+    Merges export of viewing activity to already prepared data, viewings that are already in stored data (same
+    Profile Name, Start Time and Title) are skipped and only new viewings are prepared by prepare_data.
+    :param stored: prepared data (as returned by prepare_data)
+    :param export: ViewingActivity.csv read by read_viewing_activity or prepared data
+    :param append_only: True - export is newer export of same account, viewings older than the last stored viewing
+                        of their profile are already stored and are not compared, False - all viewings of export are
+                        compared
+    :return: tuple (merged prepared data with new viewings first, prepared new viewings)
+    """
+    candidates, compared = export, stored
+    if append_only and not stored.empty:
+        # exports are ordered by profiles, so every profile has its own last stored viewing
+        cutoffs = stored.groupby('Profile Name', observed=True)['Start Time'].max()
+        start = export['Start Time']
+        if pd.api.types.is_datetime64_any_dtype(start):
+            bounds = export['Profile Name'].astype(object).map(cutoffs).fillna(pd.Timestamp.min)
+        else:
+            # strings in TIME_FORMAT are ordered same as times, so export doesn't have to be parsed to be cut
+            cutoffs = cutoffs.dt.strftime(data_analysis_subtasks.TIME_FORMAT)
+            bounds = export['Profile Name'].astype(object).map(cutoffs).fillna('')
+        candidates = export[(start >= bounds).values]
+        # only viewings at the last stored time of profile can be in candidates too
+        last = stored.groupby('Profile Name', observed=True)['Start Time'].transform('max')
+        compared = stored[stored['Start Time'] == last]
+    keys = pd.MultiIndex.from_arrays([candidates['Profile Name'].astype(object),
+                                      data_analysis_subtasks.to_start_time(candidates['Start Time']),
+                                      candidates['Title'].astype(object)])
+    stored_keys = pd.MultiIndex.from_arrays([compared[column].astype(object) for column in KEY_COLUMNS])
+    added = data_analysis.prepare_data(candidates[~keys.isin(stored_keys)].copy())
+    return concat_viewing(added, stored), added
+
+
+def merge_exports(exports: list, stored: pd.DataFrame = None):
+    """
+    Merges more exports of viewing activity (e.g. exports downloaded at different times), exports are merged from the
+    oldest one, every export adds only viewings that aren't in older exports.
+    :param exports: list of ViewingActivity.csv read by read_viewing_activity or prepared data
+    :param stored: prepared data the exports are merged to, None - nothing stored
+    :return: tuple (merged prepared data, number of new viewings that weren't stored)
+    """
+    exports = sorted(exports, key=lambda export: latest_start(export) if not export.empty else pd.Timestamp.min)
+    if stored is None:
+        stored = data_analysis.prepare_data(exports.pop(0).copy())
+        added = len(stored)
+    else:
+        added = 0
+    for export in exports:
+        stored, new = merge_viewing_activity(stored, export)
+        added += len(new)
+    return stored, added
+
+
+# Merged uploads (in compact form) by fingerprints of uploads and name of history (see merge_uploads), least
+# recently used first.
+merged_uploads = collections.OrderedDict()
+MERGED_LOCK = threading.Lock()
+
+
+def merge_uploads(exports: list, fingerprints: list, history: str = None, arrow_strings: bool = False):
+    """
+    Merges prepared exports by merge_exports, if name of history is given, exports are merged to saved history with
+    that name and merged data are saved as the history. Result is kept for fingerprints of exports and name of
+    history in compact form (see compact.compact), so reruns of page with same uploads don't merge them (and don't
+    save history) again.
+    :param exports: prepared exports
+    :param fingerprints: fingerprints of exports
+    :param history: name of saved viewing history of account, None - exports aren't merged to history
+    :param arrow_strings: True - saved history is loaded with Arrow-backed strings
+    :return: tuple (merged prepared data, number of viewings that weren't in history or older exports)
+    """
+    key = (tuple(sorted(fingerprints)), history)
+    with MERGED_LOCK:
+        if key in merged_uploads:
+            merged_uploads.move_to_end(key)
+        else:
+            stored = load_history(history, arrow_strings) if history is not None else None
+            if stored is not None and arrow_strings:
+                stored = to_arrow_strings(stored)
+            data, added = merge_exports(exports, stored)
+            if history is not None:
+                save_history(history, data)
+            merged_uploads[key] = compact.compact(data), added
+            while len(merged_uploads) > MERGED_CACHE_SIZE:
+                merged_uploads.popitem(last=False)
+        data, added = merged_uploads[key]
+    return compact.expand(data), added
+
+
+class NetflixArchive:
+    """ Zip with whole netflix-report. Only list of members is read when archive is opened, member is decompressed
+        only when it is read, other members (pdfs, Clickstream.csv, ...) are never loaded.
+        Attributes:
+            self.zip = opened zipfile.ZipFile
+            self.tables = dict path of member -> dataframe of already read csv members
+    """
+
+    def __init__(self, file):
+        """
+        :param file: uploaded zip file (file object)
+        :raise zipfile.BadZipFile: if file isn't zip
+        """
+        file.seek(0)
+        self.zip = zipfile.ZipFile(file)
+        self.tables = {}
+
+    def find(self, path: str):
+        """
+        :param path: path of member in netflix-report, e.g. CONTENT_INTERACTION/ViewingActivity.csv
+        :return: name of member in archive (archive can have netflix-report/ folder or not) or None
+        """
+        for info in self.zip.infolist():
+            if not info.is_dir() and (info.filename == path or info.filename.endswith('/' + path)):
+                return info.filename
+        return None
+
+    def open(self, member: str):
+        """
+        Returns file object that decompresses member while it is read.
+        """
+        return self.zip.open(member)
+
+    def fingerprint(self, member: str):
+        """
+        Returns hash of member from its crc and size saved in archive, member doesn't have to be decompressed.
+        """
+        info = self.zip.getinfo(member)
+        text = '\t'.join([UPLOAD_CACHE_VERSION, 'zip', str(info.CRC), str(info.file_size)])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def read_csv(self, path: str, **kwargs):
+        """
+        Reads csv member of netflix-report when it is needed first time, later same dataframe is returned.
+        :param path: path of member in netflix-report, e.g. CONTENT_INTERACTION/MyList.csv
+        :param kwargs: arguments of pd.read_csv
+        :return: dataframe or None if archive doesn't have the member
+        """
+        member = self.find(path)
+        if member is None:
+            return None
+        if member not in self.tables:
+            with self.open(member) as file:
+                self.tables[member] = pd.read_csv(file, **kwargs)
+        return self.tables[member]
 
 
 class DataLoad:
 
-    def __init__(self):
+    def __init__(self, arrow_strings: bool = False):
+        """
+        :param arrow_strings: True - text columns of df are Arrow-backed strings (pd.StringDtype('pyarrow')) instead
+                              of python objects and categoricals, used only if pyarrow is installed
+        """
         self.name = ""
+        self.arrow_strings = arrow_strings and pyarrow is not None
         self.df = None
+        # sha256 of uploaded file, None - nothing uploaded
+        self.fingerprint = None
+        # True if df is already prepared by prepare_data
+        self.prepared = False
+        # NetflixArchive if whole netflix-report zip was uploaded, None otherwise
+        self.archive = None
+        # number of viewings added to saved history or older exports by merge_uploads, None - uploads weren't merged
+        self.added = None
 
     def search_for_file(self, regex, file):
         if re.search(regex, file.name) is not None:
@@ -30,14 +439,91 @@ class DataLoad:
             self.name = option
 
     def check_structure(self, file):
+        if self.read_upload(file):
+            self.get_name()
+            return True
+        return False
+
+    def check_structures(self, files: list, history: str = None):
+        """
+        Loads more uploaded exports (ViewingActivity.csv or netflix-report zip) and merges them to one df, viewings
+        that are in more exports are kept once. Every export is prepared (and saved for next upload of same file)
+        before merging, same set of exports is merged only once (see merge_uploads).
+        :param files: uploaded files
+        :param history: name of saved viewing history of account, exports are also merged to it and merged data are
+                        saved, None - exports aren't merged to history
+        :return: True if all files have correct structure, False otherwise
+        """
+        if len(files) == 1 and history is None:
+            return self.check_structure(files[0])
+        exports = []
+        fingerprints = []
+        for file in files:
+            upload = DataLoad(self.arrow_strings)
+            if not upload.read_upload(file):
+                return False
+            upload.prepare()
+            exports.append(upload.df)
+            fingerprints.append(upload.fingerprint)
+            self.archive = self.archive or upload.archive
+        self.df, self.added = merge_uploads(exports, fingerprints, history, self.arrow_strings)
+        self.prepared = True
+        self.get_name()
+        return True
+
+    def read_upload(self, file):
+        """
+        Reads uploaded ViewingActivity.csv or ViewingActivity.csv from uploaded netflix-report zip to df.
+        :return: True if file has correct structure, False otherwise
+        """
+        if self.search_for_file(r"\.zip$", file):
+            try:
+                self.archive = NetflixArchive(file)
+            except zipfile.BadZipFile:
+                return False
+            member = self.archive.find(VIEWING_ACTIVITY)
+            if member is None:
+                return False
+            return self.load_viewing_activity(lambda: self.archive.open(member), self.archive.fingerprint(member))
         if self.search_for_file("ViewingActivity.csv*", file):
-            self.df = pd.read_csv(file)
-            if {'Profile Name', 'Start Time', 'Duration', 'Attributes', 'Title', 'Supplemental Video Type',
-                'Device Type', 'Bookmark', 'Latest Bookmark', 'Country'}.issubset(self.df.columns):
-                self.get_name()
+            # uploaded file belongs to file uploader and stays open, next rerun of page reads the same file object again
+            return self.load_viewing_activity(lambda: contextlib.nullcontext(file), upload_fingerprint(file))
+        return False
+
+    def load_viewing_activity(self, open_file, fingerprint: str):
+        """
+        Loads ViewingActivity.csv to df, if file with same fingerprint was already prepared, saved data are used.
+        :param open_file: function returning file object of ViewingActivity.csv at its start, file is used as context
+                          manager and closed after it is read
+        :param fingerprint: hash of content of file
+        :return: True if file has correct structure, False otherwise
+        """
+        # uploads are saved separately for arrow strings mode, saved columns have other types
+        self.fingerprint = fingerprint + '-arrow' if self.arrow_strings else fingerprint
+        cached = load_cached_upload(self.fingerprint, self.arrow_strings)
+        if cached is not None:
+            # same file was already uploaded, prepared data are used instead of parsing it
+            self.df = cached
+            self.prepared = True
+            return True
+        with open_file() as file:
+            if REQUIRED_COLUMNS.issubset(read_header(file)):
+                self.df = read_viewing_activity(file, self.arrow_strings)
                 return True
         return False
 
+    def prepare(self):
+        """
+        Prepares df for analysis by prepare_data and saves it for next upload of same file, df loaded from saved upload
+        is already prepared.
+        Returns None
+        """
+        if not self.prepared:
+            self.df = data_analysis.prepare_data(self.df)
+            self.prepared = True
+            if self.fingerprint is not None:
+                save_cached_upload(self.fingerprint, self.df)
+
 # folders = ['netflix-report/MESSAGES/MessagesSentByNetflix.csv', 'netflix-report/CUSTOMER_SERVICE/CSContact.txt',
 #            'netflix-report/CUSTOMER_SERVICE/ChatTranscripts.txt',
 #            'netflix-report/CLICKSTREAM/Clickstream.csv',
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+from src.scraper import metadata_store
+
+DONE = 'done'
+FAILED = 'failed'
+NOT_FOUND = 'not_found'
+
+
+def checkpoint_path(titles, series):
+    """
+    Returns path of journal for scraping of given titles - same titles (same upload and profile) have same journal.
+    """
+    digest = hashlib.sha1()
+    for title, is_series in sorted(zip(titles, series)):
+        digest.update((title + '\t' + str(bool(is_series)) + '\n').encode())
+    return metadata_store.cache_path('checkpoint-' + digest.hexdigest() + '.jsonl')
+
+
+class ScrapeJournal:
+    """ Journal of scraping progress saved on disk line by line, so stopped scraping can be resumed.
+        Attributes:
+            self.path = path of journal file, every line is one json with title, series, status and scraped record
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of journal file, it is created when first title is written
+        """
+        self.path = str(path)
+        self.lock = threading.Lock()
+        # True when cut last line of journal (from killed scraping) was already removed
+        self.repaired = False
+
+    def load(self):
+        """
+        Reads journal, later lines rewrite earlier lines of same title.
+        :return: dict (title, series) -> dict with status and record
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line can be cut when scraping was killed while writing
+                    continue
+                entries[(entry['title'], entry['series'])] = entry
+        return entries
+
+    def write(self, title: str, series: bool, status: str, record: dict = None):
+        """
+        Appends result of scraping of one title to journal.
+        :param title: name of title
+        :param series: True - title is series, False - title is movie
+        :param status: DONE, FAILED or NOT_FOUND
+        :param record: dict with scraped data for DONE title
+        :return: None
+        """
+        line = json.dumps({'title': title, 'series': bool(series), 'status': status, 'record': record},
+                          ensure_ascii=False)
+        with self.lock:
+            if not self.repaired:
+                self.repair()
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+                file.flush()
+
+    def repair(self):
+        """
+        Removes cut last line of journal, otherwise next line would be appended to it and both would be lost.
+        :return: None
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as file:
+                content = file.read()
+                if content and not content.endswith(b'\n'):
+                    file.truncate(content.rfind(b'\n') + 1)
+        self.repaired = True
+
+    def remove(self):
+        """
+        Deletes journal file.
+        :return: None
+        """
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
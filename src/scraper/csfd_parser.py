@@ -0,0 +1,162 @@
+import re
+from typing import NamedTuple, Optional
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+# Only these parts of pages are built into tree, rest of page is skipped by parser.
+SEARCH_STRAINER = SoupStrainer("section", {"class": re.compile(r'(^|\s)main-(series|movies)(\s|$)')})
+FILM_STRAINER = SoupStrainer("div", {"class": re.compile(r'(^|\s)(film-info-content|rating-average)(\s|$)')})
+TAG_PATTERNS = {tag: re.compile(r'<(/?)' + tag + r'\b', re.IGNORECASE) for tag in ['div', 'section']}
+
+
+class FilmRecord(NamedTuple):
+    """ Data scraped from page of film/series. """
+    year_start: int = -1
+    year_end: int = -1
+    genre: str = '-'
+    country: str = '-'
+    actors: str = '-'
+    rating: int = -1
+
+    def to_dict(self):
+        """
+        :return: dict with columns of scraped table
+        """
+        return {'Year Start': self.year_start, 'Year End': self.year_end, 'Genre': self.genre,
+                'Country': self.country, 'Actors': self.actors, 'Rating': self.rating}
+
+
+def to_text(content):
+    """
+    Returns html of page as string.
+    """
+    if isinstance(content, bytes):
+        return content.decode('utf-8', 'replace')
+    return content
+
+
+def extract_element(html: str, marker: str, tag: str):
+    """
+    Cuts from html whole element tag which has marker in its opening tag, without parsing rest of page.
+    :param html: html of page
+    :param marker: text in opening tag of element, usually its class
+    :param tag: name of element
+    :return: html of element or None if it wasn't found
+    """
+    position = html.find(marker)
+    if position == -1:
+        return None
+    start = html.rfind('<' + tag, 0, position)
+    if start == -1 or html.find('>', start, position) != -1:
+        return None
+    depth = 0
+    for match in TAG_PATTERNS[tag].finditer(html, start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            end = html.find('>', match.end())
+            return html[start:end + 1] if end != -1 else None
+    return None
+
+
+def parse_search_page(content, data_title: str, series: bool):
+    """
+    Finds on search page url of correct title. Title is chosen based on if it is series or movies and title name match.
+    :param content: html of search page
+    :param data_title: name of title in netflix data
+    :param series: True - title is series, False - title is movie
+    :return: string of url of correct title or None
+    """
+    section_class = "main-series" if series else "main-movies"
+    fragment = extract_element(to_text(content), section_class, 'section')
+    if fragment is not None:
+        content = fragment
+    soup = BeautifulSoup(content, PARSER, parse_only=SEARCH_STRAINER)
+    section = soup.find("section", {"class": section_class})
+    if section is None:
+        return None
+    for header in section.find_all("header", {"class": "article-header"}):
+        link = header.find("a", {"class": "film-title-name"})
+        search_name = header.find("p", {"class": "search-name"})
+        if search_name is not None and search_name.text.translate({ord(i): None for i in ')('}) == data_title:
+            return link.attrs['href']
+        if link is not None and link.text == data_title:
+            return link.attrs['href']
+    return None
+
+
+def actors_from_header(header):
+    """
+    Returns string with first five actors listed after header 'Hrají: ', divided by ','.
+    """
+    actors = [actor.text for actor in header.parent.find_all("a", href=True, limit=5)]
+    if 0 < len(actors) < 5:
+        actors.append('')
+    return ','.join(actors)
+
+
+def years_country_from_origin(text: str):
+    """
+    Returns country, year of start and year of end (for movies, the years are same) from text of origin of title.
+    :raise ValueError: if text doesn't have country and years
+    """
+    parts = text.split(',')
+    if len(parts) < 2:
+        raise ValueError("Origin of title doesn't have year: " + text.strip())
+    years = parts[1].translate({ord(i): None for i in ')( \n\t'}).split('–')
+    return parts[0], int(years[0]), int(years[-1])
+
+
+def record_from_soup(soup):
+    """
+    Takes rating, actors, years, country and genre in one walk through parsed tags.
+    :param soup: parsed rating and info parts of page of film/series
+    :return: FilmRecord or None if some data are missing
+    """
+    rating: Optional[int] = None
+    actors = ''
+    genre = country = None
+    year_start = year_end = None
+    for tag in soup.find_all(["div", "h4"]):
+        if tag.name == "h4":
+            if actors == '' and tag.text == 'Hrají: ':
+                actors = actors_from_header(tag)
+            continue
+        classes = tag.get("class", [])
+        if rating is None and "rating-average" in classes:
+            value = tag.text.strip().translate({ord(i): None for i in '%'})
+            try:
+                rating = int(float(value))
+            except ValueError:
+                rating = 50
+        elif country is None and "origin" in classes:
+            country, year_start, year_end = years_country_from_origin(tag.text)
+        elif genre is None and "genres" in classes:
+            genre = ','.join(tag.text.split('/')).translate({ord(i): None for i in ' \n\t'})
+    if rating is None or genre is None or country is None:
+        return None
+    return FilmRecord(year_start, year_end, genre, country, actors, rating)
+
+
+def parse_film_page(content):
+    """
+    Scrapes page of film/series for rating, actors, years, country and genre. Only rating and info parts of page are
+    parsed, if they can't be cut out of page, whole page is parsed with parser skipping other tags.
+    :param content: html of page of film/series
+    :return: FilmRecord
+    """
+    html = to_text(content)
+    rating_part = extract_element(html, 'rating-average', 'div')
+    info_part = extract_element(html, 'film-info-content', 'div')
+    if rating_part is not None and info_part is not None:
+        record = record_from_soup(BeautifulSoup(rating_part + info_part, PARSER, parse_only=FILM_STRAINER))
+        if record is not None:
+            return record
+    record = record_from_soup(BeautifulSoup(content, PARSER, parse_only=FILM_STRAINER))
+    if record is None:
+        raise ValueError("Page of title doesn't have expected structure.")
+    return record
@@ -0,0 +1,175 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+# Number of jobs running at once in whole process, requests of all jobs share one rate limit (see CSFD_LIMITER).
+JOB_WORKERS = 4
+# Seconds for how long ended job is kept, so reruns of page find it.
+JOB_TTL = 10 * 60
+
+
+class ScrapeJob:
+    """ Scraping running in background worker, its progress can be read without waiting for it.
+        Attributes:
+            self.job_id = id of job
+            self.status = RUNNING, FINISHED or FAILED
+            self.finished = number of scraped titles
+            self.total = number of all titles to scrape
+            self.result = last result yielded by scraping (complete result when job is finished)
+            self.error = exception that stopped job or None
+            self.ended = time (time.monotonic) when job finished or failed, None - job is running
+            self.collected = True if result of ended job was already collected (see collect)
+    """
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.status = RUNNING
+        self.finished = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.future = None
+        self.ended = None
+        self.collected = False
+
+    def run(self, batches):
+        """
+        Consumes generator of scraping and saves its progress.
+        :param batches: generator yielding tuples (result, number of scraped titles, number of all titles)
+        :return: None
+        """
+        try:
+            for result, finished, total in batches:
+                with self.lock:
+                    self.result, self.finished, self.total = result, finished, total
+            with self.lock:
+                self.status = FINISHED
+                self.ended = time.monotonic()
+        except Exception as error:
+            with self.lock:
+                self.status = FAILED
+                self.error = error
+                self.ended = time.monotonic()
+
+    def progress(self):
+        """
+        :return: tuple (status, last result, number of scraped titles, number of all titles)
+        """
+        with self.lock:
+            return self.status, self.result, self.finished, self.total
+
+    def done(self):
+        """
+        :return: True if job is finished or failed
+        """
+        with self.lock:
+            return self.status != RUNNING
+
+    def stopped(self):
+        """
+        :return: True if job finished before all titles were scraped (it was stopped by time limit)
+        """
+        with self.lock:
+            return self.status == FINISHED and self.finished < self.total
+
+    def collect(self):
+        """
+        Marks result of ended job as collected.
+        :return: True if job ended and its result wasn't collected before (result should be saved now), False otherwise
+        """
+        with self.lock:
+            if self.status == RUNNING or self.collected:
+                return False
+            self.collected = True
+            return True
+
+
+class JobQueue:
+    """ Background worker running scraping jobs outside of runs of streamlit script, ended jobs are kept for ttl
+        seconds (or until they are removed), so every rerun of page can find its job by key. Jobs stopped by time
+        limit are kept until they are started again (see submit), only their collected result is dropped after ttl.
+        Attributes:
+            self.ttl = seconds for how long ended job is kept
+            self.executor = pool of threads running jobs
+            self.jobs = dict job id -> ScrapeJob
+            self.keys = dict key of job (e.g. hash of uploaded data) -> job id
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl: float = JOB_TTL):
+        """
+        :param max_workers: number of jobs running at once, other jobs wait in queue
+        :param ttl: seconds for how long ended job is kept
+        """
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scrape-job')
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.jobs = {}
+        self.keys = {}
+
+    def submit(self, key, batches_factory, restart: bool = False):
+        """
+        Starts job for key, if job with same key is running or finished, it is returned instead. Failed job is started
+        again, job stopped by time limit only if restart is True (scraping continues from journal).
+        :param key: hashable key of job
+        :param batches_factory: function without arguments returning generator of scraping
+        :param restart: True - ended job with same key is started again
+        :return: ScrapeJob
+        """
+        with self.lock:
+            self.evict()
+            if key in self.keys and self.keys[key] in self.jobs:
+                job = self.jobs[self.keys[key]]
+                if not job.done() or (job.status == FINISHED and not restart):
+                    return job
+            job = ScrapeJob(next(self.ids))
+            self.jobs[job.job_id] = job
+            self.keys[key] = job.job_id
+            job.future = self.executor.submit(lambda: job.run(batches_factory()))
+            return job
+
+    def get(self, job_id: int):
+        """
+        :return: ScrapeJob with job_id or None
+        """
+        with self.lock:
+            self.evict()
+            return self.jobs.get(job_id)
+
+    def evict(self):
+        """
+        Forgets jobs that ended more than ttl seconds ago, so their results don't stay in memory. Jobs stopped by time
+        limit are kept without collected result, so page doesn't start them again. Lock has to be held.
+        :return: None
+        """
+        now = time.monotonic()
+        expired = set()
+        for job_id, job in self.jobs.items():
+            if job.ended is not None and now - job.ended > self.ttl:
+                if not job.stopped():
+                    expired.add(job_id)
+                elif job.collected:
+                    with job.lock:
+                        job.result = None
+        if expired:
+            for job_id in expired:
+                del self.jobs[job_id]
+            self.keys = {key: value for key, value in self.keys.items() if value not in expired}
+
+    def remove(self, job_id: int):
+        """
+        Forgets finished job, running job is not stopped.
+        :return: None
+        """
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.keys = {key: value for key, value in self.keys.items() if value != job_id}
+
+
+# Queue shared by all sessions of app, it lives as long as the server process.
+QUEUE = JobQueue()
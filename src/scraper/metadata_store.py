@@ -0,0 +1,122 @@
+import pathlib
+import sqlite3
+import threading
+import time
+
+COLUMNS = ['Year Start', 'Year End', 'Genre', 'Country', 'Actors', 'Rating']
+
+
+def cache_path(file_name: str):
+    """
+    Returns path of file in cache directory of project (created if it doesn't exist).
+    """
+    path = pathlib.Path(__file__).absolute().parents[2] / 'cache'
+    path.mkdir(parents=True, exist_ok=True)
+    return path / file_name
+
+
+def normalize_title(title: str):
+    """
+    Returns title in form used as key in store - lower case and with single spaces.
+    """
+    return ' '.join(title.casefold().split())
+
+
+class MetadataStore:
+    """ Persistent store of scraped data about titles, shared between sessions and profiles. It also keeps url of
+        page of every title found on search page, so search page doesn't have to be requested again.
+        Attributes:
+            self.path = path of sqlite database
+            self.ttl = number of seconds after which saved title is scraped again
+            self.url_ttl = number of seconds after which url of title is searched again
+            self.not_found_ttl = number of seconds after which title that wasn't found is searched again
+            self.connection = connection to sqlite database
+    """
+
+    def __init__(self, path=None, ttl: float = 30 * 24 * 60 * 60, url_ttl: float = 365 * 24 * 60 * 60,
+                 not_found_ttl: float = 7 * 24 * 60 * 60):
+        """
+        Opens (or creates) sqlite database with table of titles and table of urls.
+        :param path: path of database file, None for default file in cache directory
+        :param ttl: seconds for how long saved data are valid
+        :param url_ttl: seconds for how long saved urls are valid
+        :param not_found_ttl: seconds for how long is remembered that title is not on csfd
+        """
+        self.path = str(path if path is not None else cache_path('metadata.sqlite'))
+        self.ttl = ttl
+        self.url_ttl = url_ttl
+        self.not_found_ttl = not_found_ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS titles ('
+                                    'title TEXT NOT NULL, series INTEGER NOT NULL, year_start INTEGER, '
+                                    'year_end INTEGER, genre TEXT, country TEXT, actors TEXT, rating INTEGER, '
+                                    'scraped_at REAL NOT NULL, PRIMARY KEY (title, series))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS urls ('
+                                    'title TEXT NOT NULL, series INTEGER NOT NULL, url TEXT, '
+                                    'resolved_at REAL NOT NULL, PRIMARY KEY (title, series))')
+
+    def get(self, title: str, series: bool):
+        """
+        :param title: name of title
+        :param series: True - title is series, False - title is movie
+        :return: dict with columns of scraped table or None if title is not saved or is too old
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT year_start, year_end, genre, country, actors, rating, scraped_at '
+                                          'FROM titles WHERE title = ? AND series = ?',
+                                          (normalize_title(title), int(bool(series)))).fetchone()
+        if row is None or time.time() - row[-1] > self.ttl:
+            return None
+        return dict(zip(COLUMNS, row[:-1]))
+
+    def put(self, title: str, series: bool, record: dict):
+        """
+        Saves scraped data of title.
+        :param title: name of title
+        :param series: True - title is series, False - title is movie
+        :param record: dict with columns of scraped table
+        :return: None
+        """
+        values = [int(record['Year Start']), int(record['Year End']), record['Genre'], record['Country'],
+                  record['Actors'], int(record['Rating'])]
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [normalize_title(title), int(bool(series))] + values + [time.time()])
+
+    def get_url(self, title: str, series: bool):
+        """
+        :param title: name of title
+        :param series: True - title is series, False - title is movie
+        :return: (True, url) if url is saved, (True, None) if it is saved that title is not on csfd, (False, None) if
+                 nothing valid is saved
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT url, resolved_at FROM urls WHERE title = ? AND series = ?',
+                                          (normalize_title(title), int(bool(series)))).fetchone()
+        if row is None:
+            return False, None
+        url, resolved_at = row
+        if time.time() - resolved_at > (self.url_ttl if url is not None else self.not_found_ttl):
+            return False, None
+        return True, url
+
+    def put_url(self, title: str, series: bool, url):
+        """
+        Saves url of page of title found on search page.
+        :param title: name of title
+        :param series: True - title is series, False - title is movie
+        :param url: url of title, None - title is not on csfd
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)',
+                                    (normalize_title(title), int(bool(series)), url, time.time()))
+
+    def close(self):
+        """
+        Closes connection to database.
+        :return: None
+        """
+        self.connection.close()
@@ -0,0 +1,193 @@
+import json
+import pathlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of buckets of latency histograms.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('rate_limit_wait', 'search_fetch', 'search_parse', 'film_fetch', 'film_parse')
+
+
+class Histogram:
+    """ Histogram of durations with fixed buckets, counts are not cumulative.
+        Attributes:
+            self.buckets = upper bounds of buckets
+            self.counts = number of values in every bucket, last one is for values above all bounds
+            self.sum = sum of all values
+            self.count = number of all values
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Adds value to histogram.
+        :return: None
+        """
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        """
+        :return: dict with buckets (bound -> count), sum, count and mean
+        """
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count,
+                'mean': self.sum / self.count if self.count else 0.0}
+
+
+class ScrapeMetrics:
+    """ Metrics of scraping - durations of phases, status codes of responses, statuses of titles, hits and misses of
+        caches and throughput. All methods can be called from more threads.
+        Attributes:
+            self.phases = dict phase -> Histogram of its durations (phases in PHASES)
+            self.status_codes = Counter of status codes of responses
+            self.titles = Counter of statuses of finished titles (done, failed, not_found)
+            self.cache = Counter of (name of cache, 'hit' or 'miss')
+            self.started = time when scraping started, None - not started
+            self.requests = number of sent requests
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.status_codes = Counter()
+        self.titles = Counter()
+        self.cache = Counter()
+        self.started = None
+        self.requests = 0
+
+    def start(self):
+        """
+        Saves time when scraping started, only first call is used.
+        :return: None
+        """
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+
+    def observe(self, phase: str, seconds: float):
+        """
+        Adds duration of phase.
+        :return: None
+        """
+        with self.lock:
+            if phase not in self.phases:
+                self.phases[phase] = Histogram()
+            self.phases[phase].observe(seconds)
+
+    @contextmanager
+    def timer(self, phase: str):
+        """
+        Context manager measuring duration of its block as phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def response(self, status_code: int):
+        """
+        Counts response with status code.
+        :return: None
+        """
+        with self.lock:
+            self.requests += 1
+            self.status_codes[int(status_code)] += 1
+
+    def title(self, status: str):
+        """
+        Counts finished title with status.
+        :return: None
+        """
+        with self.lock:
+            self.titles[status] += 1
+
+    def cache_result(self, cache: str, hit: bool):
+        """
+        Counts hit or miss of cache (e.g. 'store' for saved titles, 'url' for saved urls).
+        :return: None
+        """
+        with self.lock:
+            self.cache[(cache, 'hit' if hit else 'miss')] += 1
+
+    def to_dict(self):
+        """
+        :return: dict with all metrics, it can be saved as json
+        """
+        with self.lock:
+            elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+            titles = sum(self.titles.values())
+            caches = sorted({cache for cache, _ in self.cache})
+            return {
+                'elapsed_seconds': elapsed,
+                'requests': self.requests,
+                'titles': dict(self.titles),
+                'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+                'cache': {cache: {'hit': self.cache[(cache, 'hit')], 'miss': self.cache[(cache, 'miss')],
+                                  'hit_rate': self.cache[(cache, 'hit')] /
+                                  max(1, self.cache[(cache, 'hit')] + self.cache[(cache, 'miss')])}
+                          for cache in caches},
+                'titles_per_second': titles / elapsed if elapsed > 0 else 0.0,
+                'pages_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+                'phases': {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+            }
+
+    def to_json(self):
+        """
+        :return: metrics as json string
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'csfd_scrape'):
+        """
+        :param prefix: prefix of names of metrics
+        :return: metrics in Prometheus text format
+        """
+        metrics = self.to_dict()
+        lines = ['# TYPE ' + prefix + '_phase_seconds histogram']
+        for phase, histogram in metrics['phases'].items():
+            cumulative = 0
+            for bound, count in histogram['buckets'].items():
+                cumulative += count
+                lines.append('{}_phase_seconds_bucket{{phase="{}",le="{}"}} {}'.format(prefix, phase, bound,
+                                                                                      cumulative))
+            lines.append('{}_phase_seconds_sum{{phase="{}"}} {}'.format(prefix, phase, histogram['sum']))
+            lines.append('{}_phase_seconds_count{{phase="{}"}} {}'.format(prefix, phase, histogram['count']))
+        lines.append('# TYPE ' + prefix + '_responses_total counter')
+        for code, count in metrics['status_codes'].items():
+            lines.append('{}_responses_total{{code="{}"}} {}'.format(prefix, code, count))
+        lines.append('# TYPE ' + prefix + '_titles_total counter')
+        for status, count in metrics['titles'].items():
+            lines.append('{}_titles_total{{status="{}"}} {}'.format(prefix, status, count))
+        lines.append('# TYPE ' + prefix + '_cache_total counter')
+        for cache, counts in metrics['cache'].items():
+            for result in ['hit', 'miss']:
+                lines.append('{}_cache_total{{cache="{}",result="{}"}} {}'.format(prefix, cache, result,
+                                                                               counts[result]))
+        for gauge in ['titles_per_second', 'pages_per_second', 'elapsed_seconds']:
+            lines.append('# TYPE {}_{} gauge'.format(prefix, gauge))
+            lines.append('{}_{} {}'.format(prefix, gauge, metrics[gauge]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Saves metrics to file, as json if file name ends with .json, otherwise in Prometheus text format.
+        :return: None
+        """
+        path = pathlib.Path(path)
+        path.write_text(self.to_json() if path.suffix == '.json' else self.to_prometheus(), encoding='utf-8')
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import zlib
+from src.scraper import metadata_store
+
+
+class PageStore:
+    """ Store of raw pages downloaded from csfd, so they can be parsed again without requests. Pages are compressed and
+        saved by hash of content, same page fetched more times is saved once, index keeps every fetch of url.
+        Attributes:
+            self.path = directory of store, blobs/ has compressed pages, index.sqlite has table of fetches
+            self.level = zlib compression level
+            self.connection = connection to sqlite index
+    """
+
+    def __init__(self, path=None, level: int = 6):
+        """
+        Opens (or creates) store in directory.
+        :param path: directory of store, None for default directory in cache directory
+        :param level: zlib compression level (1 fastest - 9 smallest)
+        """
+        self.path = pathlib.Path(path if path is not None else metadata_store.cache_path('pages'))
+        (self.path / 'blobs').mkdir(parents=True, exist_ok=True)
+        self.level = level
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path / 'index.sqlite'), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS fetches (url TEXT NOT NULL, fetched_at REAL NOT NULL, '
+                                    'digest TEXT NOT NULL, size INTEGER NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS fetches_url ON fetches (url, fetched_at)')
+
+    def blob_path(self, digest: str):
+        """
+        Returns path of compressed page with given hash.
+        """
+        return self.path / 'blobs' / digest[:2] / (digest + '.z')
+
+    def put(self, url: str, content: bytes, fetched_at: float = None):
+        """
+        Saves page fetched from url, content is written only if same content isn't saved yet.
+        :param url: url of page
+        :param content: html of page
+        :param fetched_at: time of fetch, None - now
+        :return: sha256 hash of content
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            temporary = path.with_suffix('.' + str(threading.get_ident()) + '.tmp')
+            temporary.write_bytes(zlib.compress(content, self.level))
+            os.replace(temporary, path)
+        with self.lock, self.connection:
+            self.connection.execute('INSERT INTO fetches VALUES (?, ?, ?, ?)',
+                                    (url, time.time() if fetched_at is None else fetched_at, digest, len(content)))
+        return digest
+
+    def read(self, digest: str):
+        """
+        :param digest: hash of page
+        :return: html of page (bytes)
+        """
+        return zlib.decompress(self.blob_path(digest).read_bytes())
+
+    def latest_digest(self, url: str, before: float = None):
+        """
+        :param url: url of page
+        :param before: only fetches made before this time are used, None - all fetches
+        :return: hash of last fetched page of url or None if url wasn't fetched
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT digest FROM fetches WHERE url = ? AND fetched_at <= ? '
+                                          'ORDER BY fetched_at DESC LIMIT 1',
+                                          (url, float('inf') if before is None else before)).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, url: str, before: float = None):
+        """
+        :param url: url of page
+        :param before: only fetches made before this time are used, None - all fetches
+        :return: html (bytes) of last fetched page of url or None if url wasn't fetched
+        """
+        digest = self.latest_digest(url, before)
+        return self.read(digest) if digest is not None else None
+
+    def stats(self):
+        """
+        :return: dict with number of fetches, number of saved pages, size of pages and size of compressed pages
+        """
+        with self.lock:
+            fetches, = self.connection.execute('SELECT COUNT(*) FROM fetches').fetchone()
+            pages, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+                                                  '(SELECT DISTINCT digest, size FROM fetches)').fetchone()
+        compressed = sum(blob.stat().st_size for blob in (self.path / 'blobs').glob('*/*.z'))
+        return {'fetches': fetches, 'pages': pages, 'bytes': size, 'compressed_bytes': compressed}
+
+    def close(self):
+        """
+        Closes connection to index.
+        :return: None
+        """
+        self.connection.close()
@@ -0,0 +1,158 @@
+import abc
+import json
+import pathlib
+import pandas as pd
+from src.scraper.scrape_data import ScrapeData, EMPTY_RECORD
+from src.scraper.metadata_store import COLUMNS, MetadataStore, normalize_title
+from src.scraper.checkpoint import ScrapeJournal, checkpoint_path
+
+# Names of columns of metadata dump, other names in dump are translated to these (see OfflineProvider.from_table).
+DUMP_COLUMNS = {'title': 'title', 'series': 'series', 'year_start': 'year_start', 'year_end': 'year_end',
+                'year': 'year_start', 'genre': 'genre', 'genres': 'genre', 'country': 'country', 'actors': 'actors',
+                'rating': 'rating'}
+
+
+class MetadataProvider(abc.ABC):
+    """ Source of metadata of titles. Subclasses implement iter_lookup, results are tables in format of
+        ScrapeData.get_scraped_data (columns Title, Year Start, Year End, Genre, Country, Actors, Rating, index of
+        given titles), titles without metadata have values -1 or '-'.
+        Attributes:
+            self.deadline_reached = True if last lookup was stopped before all titles were looked up
+    """
+    deadline_reached = False
+
+    @abc.abstractmethod
+    def iter_lookup(self, titles: pd.DataFrame, batch_size: int = 10):
+        """
+        Looks up metadata of titles, generator yields during lookup.
+        :param titles: dataframe with columns Title and Series
+        :param batch_size: number of looked up titles after which table is yielded
+        :return: generator of tuples (table with metadata, number of looked up titles)
+        """
+
+    def lookup(self, titles: pd.DataFrame):
+        """
+        :param titles: dataframe with columns Title and Series
+        :return: table with metadata of all titles
+        """
+        table = None
+        for table, _ in self.iter_lookup(titles):
+            pass
+        return table
+
+
+class CsfdProvider(MetadataProvider):
+    """ Metadata scraped from csfd.cz by ScrapeData. Scraped data are saved in MetadataStore and progress of scraping
+        in ScrapeJournal, so stopped scraping continues where it ended.
+        Attributes:
+            self.store = MetadataStore shared by scrapings, None - default store in cache directory (opened by first
+                         lookup)
+            self.own_store = True if store was opened by provider, it is closed by close
+            self.time_budget = seconds after which scraping stops, None - no limit
+            self.kwargs = other arguments of ScrapeData (session, requests_per_second, ...)
+    """
+
+    def __init__(self, store: MetadataStore = None, time_budget: float = None, **kwargs):
+        self.store = store
+        self.own_store = store is None
+        self.time_budget = time_budget
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes store opened by provider, given store is left open.
+        :return: None
+        """
+        if self.own_store and self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def iter_lookup(self, titles: pd.DataFrame, batch_size: int = 10):
+        if self.store is None:
+            self.store = MetadataStore()
+        journal = ScrapeJournal(checkpoint_path(titles['Title'], titles['Series']))
+        scrape = ScrapeData(titles, store=self.store, journal=journal, time_budget=self.time_budget, **self.kwargs)
+        for finished in scrape.iter_scraping(batch_size):
+            yield scrape.get_scraped_data(), finished
+        self.deadline_reached = scrape.deadline_reached
+        if not scrape.deadline_reached:
+            journal.remove()
+
+
+class OfflineProvider(MetadataProvider):
+    """ Metadata from local dump of titles (csv or json), no requests are sent.
+        Attributes:
+            self.index = dict (normalized title, series) -> tuple of values of COLUMNS, titles without series column
+                         in dump have series None and match both movies and series
+    """
+
+    def __init__(self, index: dict):
+        self.index = index
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame):
+        """
+        Builds index from table with columns title, year_start (or year), year_end, genre (or genres), country,
+        actors, rating and optional series. Names of columns are not case sensitive, genres and actors can also be
+        lists.
+        :param table: dataframe with metadata of titles
+        :return: OfflineProvider
+        """
+        table = table.rename(columns=lambda column: DUMP_COLUMNS.get(str(column).strip().lower().replace(' ', '_'),
+                                                                     column))
+        if 'title' not in table.columns:
+            raise ValueError("Metadata dump doesn't have column title.")
+        table = table.drop_duplicates(['title', 'series'] if 'series' in table.columns else ['title'], keep='last')
+        rows = len(table)
+        year_start = table['year_start'] if 'year_start' in table.columns else pd.Series(-1, index=table.index)
+        year_end = table['year_end'] if 'year_end' in table.columns else year_start
+        columns = [pd.to_numeric(year_start, errors='coerce').fillna(-1).astype('int64'),
+                   pd.to_numeric(year_end, errors='coerce').fillna(year_start).fillna(-1).astype('int64')]
+        for column in ['genre', 'country', 'actors']:
+            values = table[column] if column in table.columns else pd.Series('-', index=table.index)
+            columns.append(values.map(lambda value: ','.join(value) if isinstance(value, list) else value)
+                           .fillna('-').astype(str))
+        rating = table['rating'] if 'rating' in table.columns else pd.Series(-1, index=table.index)
+        columns.append(pd.to_numeric(rating, errors='coerce').fillna(-1).astype('int64'))
+        keys = table['title'].astype(str).map(normalize_title)
+        series = table['series'].astype(bool) if 'series' in table.columns else [None] * rows
+        index = dict(zip(zip(keys, series), zip(*[column.tolist() for column in columns])))
+        return cls(index)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Imports dump of metadata from csv file or json file (list of objects, or object with list under key titles).
+        :param path: path of file
+        :return: OfflineProvider
+        """
+        path = pathlib.Path(path)
+        if path.suffix.lower() == '.json':
+            with open(path, encoding='utf-8') as file:
+                content = json.load(file)
+            if isinstance(content, dict):
+                content = content['titles']
+            return cls.from_table(pd.DataFrame(content))
+        return cls.from_table(pd.read_csv(path))
+
+    def get(self, title: str, series: bool):
+        """
+        :return: tuple of values of COLUMNS or None if title is not in dump
+        """
+        key = normalize_title(title)
+        record = self.index.get((key, bool(series)))
+        return record if record is not None else self.index.get((key, None))
+
+    def iter_lookup(self, titles: pd.DataFrame, batch_size: int = 10):
+        empty = tuple(EMPTY_RECORD[column] for column in COLUMNS)
+        rows = [self.get(title, series) or empty for title, series in zip(titles['Title'], titles['Series'])]
+        table = pd.DataFrame(rows, columns=COLUMNS, index=titles.index)
+        table = table.astype({'Year Start': 'int64', 'Year End': 'int64', 'Rating': 'int64'})
+        table.insert(0, 'Title', titles['Title'])
+        yield table, len(table)
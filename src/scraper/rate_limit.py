@@ -0,0 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+class RateLimiter:
+    """ Politeness budget shared by all threads that scrape data.
+        Attributes:
+            self.rate = how many requests per second can be made in total
+            self.burst = how many requests can be made at once after a idle period
+            self.max_per_host = how many requests can be in flight to one host at the same time
+            self.tokens = tokens left in bucket, one request costs one token
+    """
+
+    def __init__(self, requests_per_second: float = 2.0, burst: int = 1, max_per_host: int = 2):
+        """
+        Initialises token bucket and semaphores for hosts.
+        :param requests_per_second: refill rate of token bucket
+        :param burst: capacity of token bucket
+        :param max_per_host: number of concurrent requests allowed for one host
+        """
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second has to be positive")
+        self.rate = requests_per_second
+        self.burst = max(1, burst)
+        self.max_per_host = max(1, max_per_host)
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        self.host_semaphores = {}
+
+    def acquire(self):
+        """
+        Blocks until one token is available in bucket and takes it.
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def host_semaphore(self, url: str):
+        """
+        :param url: url of request
+        :return: semaphore limiting concurrent requests to host of url
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_semaphores[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        """
+        Context manager that waits for free slot of host of url and for token from bucket. Request should be made
+        inside of it.
+        :param url: url of request
+        """
+        with self.host_semaphore(url):
+            self.acquire()
+            yield
+
+
+# Politeness budget of csfd.cz shared by all scrapings in process (all sessions of app), scrapings with own session
+# or own rate have own limiter.
+CSFD_LIMITER = RateLimiter()
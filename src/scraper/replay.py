@@ -0,0 +1,75 @@
+import json
+import pathlib
+import random
+import threading
+import time
+
+EMPTY_SEARCH_PAGE = b'<html><body><div class="box-content">Nic nebylo nalezeno.</div></body></html>'
+
+
+class ReplayResponse:
+    """ Response of ReplaySession with same attributes as used from requests.Response. """
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+
+class ReplaySession:
+    """ Session that can be used in ScrapeData instead of requests.Session, answers requests with saved pages.
+        Attributes:
+            self.pages = dict url -> html of page
+            self.latency = seconds every request waits before answer
+            self.error_rate = probability of answer with status 503
+            self.requests = number of requests made
+    """
+
+    def __init__(self, pages: dict, latency: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        """
+        :param pages: dict url -> html (bytes) of page
+        :param latency: seconds every request waits before answer
+        :param error_rate: probability (0-1) of answer with status 503
+        :param seed: seed of random generator of errors
+        """
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @classmethod
+    def from_corpus(cls, directory, **kwargs):
+        """
+        Loads pages from directory with saved pages and file index.json (dict url -> file name).
+        :param directory: directory with saved pages
+        :param kwargs: latency, error_rate and seed of session
+        :return: ReplaySession
+        """
+        directory = pathlib.Path(directory)
+        with open(directory / 'index.json', encoding='utf-8') as file:
+            index = json.load(file)
+        pages = {url: (directory / name).read_bytes() for url, name in index.items()}
+        return cls(pages, **kwargs)
+
+    def get(self, url: str, headers: dict = None):
+        """
+        Returns saved page of url. Search pages which are not saved have no results, other not saved pages have
+        status 404.
+        :param url: url of page
+        :param headers: not used, for compatibility with requests.Session
+        :return: ReplayResponse
+        """
+        with self.lock:
+            self.requests += 1
+            error = self.error_rate > 0 and self.random.random() < self.error_rate
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if error:
+            return ReplayResponse(url, 503, b'')
+        if url in self.pages:
+            return ReplayResponse(url, 200, self.pages[url])
+        if '/hledat/' in url:
+            return ReplayResponse(url, 200, EMPTY_SEARCH_PAGE)
+        return ReplayResponse(url, 404, b'')
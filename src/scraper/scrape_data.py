@@ -1,8 +1,63 @@
+import threading
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import requests
 import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+from src.scraper.rate_limit import RateLimiter, CSFD_LIMITER
+from src.scraper.csfd_parser import FilmRecord, parse_search_page, parse_film_page
+from src.scraper.metadata_store import COLUMNS
+from src.scraper.checkpoint import DONE, FAILED, NOT_FOUND
+from src.scraper.single_flight import SingleFlight, CSFD_FLIGHTS
+from src.scraper.page_store import PageStore
+from src.scraper.metrics import ScrapeMetrics
+
+EMPTY_RECORD = FilmRecord().to_dict()
+REQUESTS_PER_SECOND = 2.0
+MAX_PER_HOST = 2
+# PageStore opened in every process of reparse_from_store
+REPARSE_STORE = None
+
+
+def estimate_duration(titles: int, requests_per_second: float = REQUESTS_PER_SECOND):
+    """
+    :return: estimated number of seconds scraping of titles takes, there are two requests for every title
+    """
+    return 2 * titles / requests_per_second
+
+
+def init_reparse_worker(path: str):
+    """
+    Opens PageStore in process of reparse_from_store.
+    """
+    global REPARSE_STORE
+    REPARSE_STORE = PageStore(path)
+
+
+def reparse_title(search_page: str, base_url: str, title: str, series: bool, before: float = None):
+    """
+    Parses saved search page and page of title from REPARSE_STORE.
+    :param search_page: url of search page of title
+    :param base_url: url of csfd added before url from search page
+    :param title: title of movies or series
+    :param series: True - title is series, False - title is movie
+    :param before: only pages fetched before this time are used, None - last fetched pages
+    :return: (DONE, record), (NOT_FOUND, None) or (FAILED, None) if page isn't saved or can't be parsed
+    """
+    content = REPARSE_STORE.get(search_page, before)
+    if content is None:
+        return FAILED, None
+    url = parse_search_page(content, title, series)
+    if url is None:
+        return NOT_FOUND, None
+    content = REPARSE_STORE.get(base_url + url, before)
+    if content is None:
+        return FAILED, None
+    try:
+        return DONE, parse_film_page(content).to_dict()
+    except ValueError:
+        return FAILED, None
 
 
 class ScrapeData:
@@ -13,163 +68,350 @@ class ScrapeData:
             self.headers = headers used for all data scraping
             self.base_url = 'https://www.csfd.cz'
             self.search_url = '/hledat/?q='
-            self.response = attribute used to save response for made request used for scraping
-            self.scraped_table = pandas table to save scraped data
+            self.titles = titles of table in order of given data, rows of scraped_table
+            self.records = dict with scraped data (dict with columns of scraped_table) for every scraped title
+            self.limiter = RateLimiter shared by all requests, replaces fixed sleeps between requests, CSFD_LIMITER
+                           shared by all scrapings of csfd.cz unless rate is given
+            self.max_workers = number of threads that scrape titles at the same time
+            self.store = MetadataStore checked before any request is made, None - always scrape
+            self.journal = ScrapeJournal where progress is saved and from which scraping is resumed, None - no journal
+            self.statuses = dict title -> status of title (DONE, FAILED, NOT_FOUND) after scraping
+            self.time_budget = seconds after which scraping stops, None - no limit
+            self.deadline_reached = True if scraping stopped because of time_budget before all titles were scraped
+            self.page_store = PageStore where every fetched page is saved, None - pages are not saved
+            self.metrics = ScrapeMetrics with durations of phases, status codes, hits of caches and throughput
+            self.flights = SingleFlight through which search and film pages are fetched and parsed, so same page
+                           requested by more scrapings at the same time is fetched once
+        Titles are scraped in order of table, so most important titles should be first.
         """
 
-    def __init__(self, data):
+    def __init__(self, data, requests_per_second: float = None, max_workers: int = 4, max_per_host: int = None,
+                 store=None, journal=None, session=None, time_budget: float = None, flights: SingleFlight = None,
+                 page_store: PageStore = None, metrics: ScrapeMetrics = None, limiter: RateLimiter = None):
         """
         Initialises all variable used for data scraping - session, headers, url
         :param data: DataFrame with name of Titles to scrape data for.
+        :param requests_per_second: how many requests per second can be sent to csfd, None - REQUESTS_PER_SECOND
+        :param max_workers: number of titles scraped concurrently
+        :param max_per_host: number of requests that can wait for response from csfd at the same time, None -
+                             MAX_PER_HOST
+        :param store: MetadataStore with already scraped titles
+        :param journal: ScrapeJournal of this scraping, if it has saved progress, scraping continues from it
+        :param session: object with method get(url, headers) used for requests, None - new requests.Session
+        :param time_budget: seconds after which scraping stops, titles not scraped till then stay empty
+        :param flights: SingleFlight shared with other scrapings, None - CSFD_FLIGHTS shared by whole process if
+                        session is None, otherwise own SingleFlight (other sessions may answer differently)
+        :param page_store: PageStore where fetched pages are saved, so they can be parsed again by reparse_from_store
+        :param metrics: ScrapeMetrics to which metrics are added (can be shared by more scrapings), None - new one
+        :param limiter: RateLimiter shared with other scrapings, None - CSFD_LIMITER shared by whole process if
+                        session, requests_per_second and max_per_host are None, otherwise own RateLimiter with
+                        requests_per_second and max_per_host
+        :raise ValueError: if limiter is given together with requests_per_second or max_per_host
         """
-        self.session = requests.Session()
+        self.session = session if session is not None else requests.Session()
         self.table = data.copy()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)'
                           ' Chrome/96.0.4664.110 Safari/536.36'}
         self.base_url = 'https://www.csfd.cz'
         self.search_url = '/hledat/?q='
-        self.response = None
+        explicit_rate = requests_per_second is not None or max_per_host is not None
+        if limiter is not None and explicit_rate:
+            raise ValueError("requests_per_second and max_per_host can't be used with given limiter")
+        if limiter is None:
+            if session is None and not explicit_rate:
+                limiter = CSFD_LIMITER
+            else:
+                limiter = RateLimiter(requests_per_second if requests_per_second is not None else REQUESTS_PER_SECOND,
+                                      max_per_host=max_per_host if max_per_host is not None else MAX_PER_HOST)
+        self.limiter = limiter
+        self.max_workers = max(1, max_workers)
+        self.lock = threading.Lock()
+        self.store = store
+        self.journal = journal
+        self.statuses = {}
+        self.time_budget = time_budget
+        self.deadline_reached = False
         self.table = self.table.reset_index(drop=True)
-        self.scraped_table = pd.DataFrame({'Title': data['Title'].copy(),
-                                           'Year Start': -1,
-                                           'Year End': -1,
-                                           'Genre': '-',
-                                           'Country': '-',
-                                           'Actors': '-',
-                                           'Rating': -1})
+        self.titles = data['Title'].copy()
+        self.records = {}
+        if flights is None:
+            flights = CSFD_FLIGHTS if session is None else SingleFlight()
+        self.flights = flights
+        self.page_store = page_store
+        self.metrics = metrics if metrics is not None else ScrapeMetrics()
 
-    def scrape_search_page(self, data_title: str, series: str):
+    def scrape_search_page(self, response, data_title: str, series: str):
         """
         Class that scrapes search page for correct title. Title is chosen based on if it is series or movies and title
         name match.
+        :param response: response with search page
         :param data_title: name of title in netflix data
         :param series: True - title is series, False - title is movie
         :return: string of url of correct title
         """
-        if self.response.status_code == 200:
-            soup = BeautifulSoup(self.response.content, 'html.parser')
-            if series:
-                soup_section = soup.find_all("section", {"class": "box main-series"})
-            else:
-                soup_section = soup.find_all("section", {"class": "box main-movies"})
-            for res in soup_section:
-                soup_name = res.find_all("header", {"class": "article-header"})
-                i = 0
-                for name in soup_name:
-                    title = name.find("p", {"class": "search-name"})
-                    if title is None:
-                        title = name.find("a", {"class": "film-title-name"})
-                        title_str = title.text
-                    else:
-                        title_str = title.text
-                        title_str = title_str.translate({ord(i): None for i in ')('})
-                        if title_str != data_title:
-                            title = name.find("a", {"class": "film-title-name"})
-                            title_str = title.text
-                    if title_str == data_title:
-                        hrefs = res.find_all("a", {"class": "film-title-name"}, href=True)
-                        link = hrefs[i].attrs['href']
-                        return link
-                    i += 1
-                return None
-
-    def scrape_actors(self, title: str, soup_film):
-        """
-        Scrapes tag soup_film for actors and saves result in scraped_table.
-        :param title: title of movies or series that is currently scraped
-        :param soup_film: tag with data to scrape
-        :return: None
+        if response.status_code == 200:
+            return parse_search_page(response.content, data_title, series)
+        return None
+
+    def scrape_film_page(self, response, title: str):
         """
-        soup_creators = soup_film.find_all("h4")
-        actors_arr = ''
-        for creator in soup_creators:
-            if creator.text == 'Hrají: ':
-                actors = creator.parent.find_all("a", href=True)
-                i = 0
-                for actor in actors:
-                    i += 1
-                    actors_arr = actors_arr + actor.text
-                    if i == 5:
-                        break
-                    actors_arr = actors_arr + ','
-        self.scraped_table.loc[self.scraped_table.Title == title, 'Actors'] = actors_arr
-
-    def scrape_film_page(self, title: str):
-        """
-        Scrapes from response data for film/series of name title. Call functions that find genre, years, rating,
-            actors and country.
+        Scrapes from response data for film/series of name title - genre, years, rating, actors and country.
+        :param response: response with page of film/series
         :param title: title of movies or series that is currently scraped
-        :return: None
+        :return: True if page was scraped, False otherwise
          """
 
-        if self.response.status_code == 200:
-            soup = BeautifulSoup(self.response.content, 'html.parser')
-            self.scrape_rating(title, soup)
-            soup_film = soup.find("div", {"class": "film-info-content"})
-            self.scrape_actors(title, soup_film)
-            self.scrape_year_country(title, soup_film)
-            self.scrape_genre(title, soup_film)
-        else:
-            print("Not found.")
+        if response.status_code == 200:
+            self.save_record(title, parse_film_page(response.content).to_dict())
+            return True
+        return False
 
-    def start_scraping(self):
+    def fetch_film(self, url: str):
+        """
+        Fetches and parses page of film/series, same url fetched by other scraping at the same time is fetched once.
+        :param url: url of page without base url
+        :return: (status code, FilmRecord or None if status isn't 200)
+        """
+        def fetch_and_parse():
+            response = self.fetch(self.base_url + url)
+            if response.status_code != 200:
+                return response.status_code, None
+            with self.metrics.timer('film_parse'):
+                return response.status_code, parse_film_page(response.content)
+        return self.flights.do(('film', url), fetch_and_parse, remember=lambda result: result[1] is not None)
+
+    def fetch(self, url: str, phase: str = 'film_fetch'):
+        """
+        Makes GET request on url when rate limiter allows it.
+        :param url: url to get
+        :param phase: phase of metrics to which duration of request is added
+        :return: response
+        """
+        start = time.perf_counter()
+        with self.limiter.slot(url):
+            sent = time.perf_counter()
+            self.metrics.observe('rate_limit_wait', sent - start)
+            response = self.session.get(url, headers=self.headers)
+            self.metrics.observe(phase, time.perf_counter() - sent)
+        self.metrics.response(response.status_code)
+        if self.page_store is not None and response.status_code == 200:
+            self.page_store.put(url, response.content)
+        return response
+
+    def search_page_url(self, title: str):
+        """
+        :return: url of search page of title
+        """
+        return self.base_url + self.search_url + '+'.join(title.split(' '))
+
+    def resolve_url(self, title: str, series: bool, use_store: bool = True):
+        """
+        Finds url of page of title on search page, or in store if it was already searched.
+        :param title: title of movies or series
+        :param series: True - title is series, False - title is movie
+        :param use_store: False - search page is requested even if url is saved
+        :return: (DONE, url), (NOT_FOUND, None) or (FAILED, None)
+        """
+        if self.store is not None and use_store:
+            saved, url = self.store.get_url(title, series)
+            self.metrics.cache_result('url', saved)
+            if saved:
+                return (DONE, url) if url is not None else (NOT_FOUND, None)
+        if not use_store:
+            return self.search_title(title, series)
+        return self.flights.do(('search', title, bool(series)), lambda: self.search_title(title, series),
+                               remember=lambda result: result[0] != FAILED)
+
+    def search_title(self, title: str, series: bool):
+        """
+        Requests search page of title and finds url of title on it.
+        :param title: title of movies or series
+        :param series: True - title is series, False - title is movie
+        :return: (DONE, url), (NOT_FOUND, None) or (FAILED, None)
         """
-        Scrapes in cycle all movies and series in table from csfd.
+        response = self.fetch(self.search_page_url(title), 'search_fetch')
+        if response.status_code != 200:
+            return FAILED, None
+        with self.metrics.timer('search_parse'):
+            url = self.scrape_search_page(response, title, series)
+        if self.store is not None:
+            self.store.put_url(title, series, url)
+        return (DONE, url) if url is not None else (NOT_FOUND, None)
+
+    def scrape_title(self, title: str, series: bool):
+        """
+        Finds title on search page and scrapes its page of film/series. Saved data and urls in store are used instead
+        of requests if there are any.
+        :param title: title of movies or series to scrape
+        :param series: True - title is series, False - title is movie
+        :return: DONE - title was scraped, NOT_FOUND - title isn't on csfd, FAILED - request or page was wrong
+        """
+        if self.store is not None:
+            record = self.store.get(title, series)
+            self.metrics.cache_result('store', record is not None)
+            if record is not None:
+                self.save_record(title, record)
+                return DONE
+        try:
+            status, title_url = self.resolve_url(title, series)
+            if status != DONE:
+                return status
+            status_code, record = self.fetch_film(title_url)
+            if status_code == 404 and self.store is not None:
+                # saved url may not be valid anymore, title is searched again
+                status, new_url = self.resolve_url(title, series, use_store=False)
+                if status != DONE:
+                    return status
+                if new_url != title_url:
+                    status_code, record = self.fetch_film(new_url)
+            if record is None:
+                return FAILED
+            self.save_record(title, record.to_dict())
+        except (requests.RequestException, ValueError):
+            return FAILED
+        if self.store is not None:
+            self.store.put(title, series, self.get_record(title))
+        return DONE
+
+    def save_record(self, title: str, record: dict):
+        """
+        Saves record with scraped data of title, it is written to scraped_table when table is built.
+        :param title: title of movies or series
+        :param record: dict with columns of scraped_table
         :return: None
         """
+        with self.lock:
+            self.records[title] = dict(record)
+
+    def get_record(self, title: str):
+        """
+        :param title: title of movies or series
+        :return: dict with scraped columns of title
+        """
+        with self.lock:
+            return dict(self.records.get(title, EMPTY_RECORD))
+
+    def resume(self):
+        """
+        Loads titles saved in journal, titles that were scraped or not found are not scraped again.
+        :return: list of (title, series) that still have to be scraped
+        """
+        saved = self.journal.load() if self.journal is not None else {}
+        to_scrape = []
         for title, series in zip(self.table.Title, self.table.Series):
-            title_name = title.split(' ')
-            self.response = self.session.get(self.base_url + self.search_url + '+'.join(title_name),
-                                             headers=self.headers)
-            title_url = self.scrape_search_page(title, series)
-            time.sleep(0.75)
-            if title_url is not None:
-                self.response = self.session.get(self.base_url + title_url, headers=self.headers)
-                self.scrape_film_page(title)
-                time.sleep(1)
-
-    def scrape_rating(self, title: str, soup_film):
-        """
-        Scrapes tag soup_film for rating and saves result in scraped_table.
-        :param title: title of movies or series that is currently scraped
-        :param soup_film: tag that has rating inside
+            entry = saved.get((title, bool(series)))
+            if entry is None or entry['status'] == FAILED:
+                to_scrape.append((title, series))
+                continue
+            if entry['status'] == DONE:
+                self.save_record(title, entry['record'])
+            self.statuses[title] = entry['status']
+        return to_scrape
+
+    def finish_title(self, title: str, series: bool, status: str):
+        """
+        Saves status of scraped title and writes it to journal.
         :return: None
         """
-        soup_rating = soup_film.find("div", {"class": "rating-average"})
-        rating = soup_rating.text.strip().translate({ord(i): None for i in '%'})
-        try:
-            self.scraped_table.loc[self.scraped_table['Title'] == title, 'Rating'] = int(float(rating))
-        except ValueError:
-            self.scraped_table.loc[self.scraped_table['Title'] == title, 'Rating'] = 50
+        self.statuses[title] = status
+        self.metrics.title(status)
+        if self.journal is not None:
+            self.journal.write(title, series, status, self.get_record(title) if status == DONE else None)
 
-    def scrape_year_country(self, title: str, soup_film):
+    def start_scraping(self):
         """
-        Scrapes tag soup_film for year of start and end (for movies, the dates are same) and country that movies was
-        made in and saves in scraped_table.
-        :param title: title of movie/series
-        :param soup_film: tag with data to scrape
+        Scrapes all movies and series in table from csfd. Titles are scraped by max_workers threads, speed is limited
+        by rate limiter. If there is journal, titles already saved in it are skipped and every finished title is
+        written to it.
         :return: None
         """
-        soup_film = soup_film.find("div", {"class": "origin"})
-        text_film = soup_film.text
-        self.scraped_table.loc[self.scraped_table.Title == title, 'Country'] = text_film.split(',')[0]
-        years = text_film.split(',')[1].translate({ord(i): None for i in ')( \n\t'})
-        years = years.split('–')
-        self.scraped_table.loc[self.scraped_table.Title == title, 'Year End'] = int(years[-1])
-        self.scraped_table.loc[self.scraped_table.Title == title, 'Year Start'] = int(years[0])
+        for _ in self.iter_scraping():
+            pass
 
-    def scrape_genre(self, title, soup_film):
+    def iter_scraping(self, batch_size: int = 10):
         """
-        Scrapes tag soup_film for genres and saves in scraped_table.
-        :param title: title of movies or series that is currently scraped
-        :param soup_film: tag with data to scrape
+        Scrapes titles same as start_scraping, but after every batch_size finished titles yields, so scraped_table
+        can be used before all titles are scraped. When generator is closed before end or time_budget runs out,
+        titles that didn't start scraping are cancelled, titles being scraped are finished.
+        :param batch_size: number of titles finished between yields
+        :return: generator of numbers of finished titles
+        """
+        deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        self.metrics.start()
+        to_scrape = self.resume()
+        yield len(self.statuses)
+        if not to_scrape:
+            return
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {executor.submit(self.scrape_title, title, series): (title, series)
+                   for title, series in to_scrape}
+        pending = set(futures)
+        try:
+            finished = 0
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    self.deadline_reached = True
+                    break
+                for future in done:
+                    title, series = futures[future]
+                    self.finish_title(title, series, future.result())
+                    finished += 1
+                    if finished % batch_size == 0 and pending:
+                        yield len(self.statuses)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        for future in pending:
+            if future.done() and not future.cancelled():
+                title, series = futures[future]
+                self.finish_title(title, series, future.result())
+        yield len(self.statuses)
+
+    def reparse_from_store(self, processes: int = None, before: float = None):
+        """
+        Builds scraped data of all titles from pages saved in page_store, no requests are made. Pages are parsed by
+        processes on all cores. Parsed titles are saved in store, so it is updated when parsing of pages changes.
+        :param processes: number of processes, None - number of cores
+        :param before: only pages fetched before this time are used, None - last fetched pages
         :return: None
         """
-        genres = soup_film.find("div", {"class": "genres"})
-        genre_arr = genres.text.split('/')
-        genre_arr = ','.join(genre_arr).translate({ord(i): None for i in ' \n\t'})
-        self.scraped_table.loc[self.scraped_table.Title == title, 'Genre'] = genre_arr
+        if self.page_store is None:
+            raise ValueError("ScrapeData doesn't have page_store to reparse.")
+        titles = list(zip(self.table.Title, self.table.Series))
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_reparse_worker,
+                                 initargs=(str(self.page_store.path),)) as executor:
+            results = executor.map(reparse_title, [self.search_page_url(title) for title, _ in titles],
+                                   [self.base_url] * len(titles), [title for title, _ in titles],
+                                   [bool(series) for _, series in titles], [before] * len(titles),
+                                   chunksize=max(1, len(titles) // (4 * processes)))
+            for (title, series), (status, record) in zip(titles, results):
+                if status == DONE:
+                    self.save_record(title, record)
+                    if self.store is not None:
+                        self.store.put(title, series, record)
+                self.statuses[title] = status
+
+    def estimate_duration(self):
+        """
+        :return: estimated number of seconds scraping takes, there are two requests for every title
+        """
+        return estimate_duration(len(self.table), self.limiter.rate)
+
+    @property
+    def scraped_table(self):
+        """
+        Pandas table with scraped data, built at once from saved records. Titles that weren't scraped have
+        values -1 or '-'.
+        """
+        with self.lock:
+            rows = [self.records.get(title, EMPTY_RECORD) for title in self.titles]
+        table = pd.DataFrame(rows, columns=COLUMNS, index=self.titles.index)
+        table = table.astype({'Year Start': 'int64', 'Year End': 'int64', 'Rating': 'int64'})
+        table.insert(0, 'Title', self.titles)
+        return table
 
     def get_scraped_data(self):
         """
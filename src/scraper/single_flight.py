@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Flight:
+    """ One running call, other callers with same key wait for its result. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Calls with same key that run at the same time are made only once, all callers get result of the one call.
+        Results of finished calls can also be kept for ttl seconds, so calls shortly after them are not made again.
+        Attributes:
+            self.ttl = seconds for how long result of finished call is kept, 0 - results are not kept
+            self.max_entries = maximum number of kept results, oldest are removed
+            self.calls = number of all calls
+            self.executions = number of calls that were really made
+            self.coalesced = number of calls that waited for same call running at the same time
+            self.hits = number of calls answered with kept result
+    """
+
+    def __init__(self, ttl: float = 0.0, max_entries: int = 10000):
+        """
+        :param ttl: seconds for how long result of finished call is kept
+        :param max_entries: maximum number of kept results
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.results = OrderedDict()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.hits = 0
+
+    def do(self, key, function, remember=None):
+        """
+        Returns result of function, if call with same key is running, waits for it and returns its result instead.
+        Exception of function is raised in all callers.
+        :param key: hashable key of call
+        :param function: function without arguments
+        :param remember: function result -> bool, if result can be kept for ttl (e.g. not failed request), None - all
+        :return: result of function
+        """
+        with self.lock:
+            self.calls += 1
+            kept = self.results.get(key)
+            if kept is not None and time.monotonic() - kept[0] <= self.ttl:
+                self.hits += 1
+                return kept[1]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight.error is None and self.ttl > 0 and (remember is None or remember(flight.result)):
+                    self.results[key] = (time.monotonic(), flight.result)
+                    self.results.move_to_end(key)
+                    while len(self.results) > self.max_entries:
+                        self.results.popitem(last=False)
+            flight.event.set()
+        return flight.result
+
+    def stats(self):
+        """
+        :return: dict with counters calls, executions, coalesced and hits
+        """
+        with self.lock:
+            return {'calls': self.calls, 'executions': self.executions, 'coalesced': self.coalesced,
+                    'hits': self.hits}
+
+
+# Shared by all scrapings of csfd.cz in process (all sessions of app), scrapings with own session have own instance.
+CSFD_FLIGHTS = SingleFlight(ttl=5 * 60)
@@ -1,15 +1,27 @@
 import pathlib
 import sys
 import pandas
-from pandas.core.base import DataError
+from pandas.errors import DataError
 import streamlit as st
-from src.data_analysis import data_load, data_analysis
+from src.data_analysis import data_load, data_analysis, compact
+from src.scraper import jobs
+
+try:
+    from streamlit_autorefresh import st_autorefresh
+except ImportError:
+    st_autorefresh = None
 # For data netflix-report/CONTENT-INTRACTION/ViewingActivity.csv I already run scraping so I have data for testing
 # purposes, it can be used with global_scrape_data = False and it shows page with large amount of data without scraping so
 # it's fast.
 # netflix-report/ViewingActivity.csv is very short version and that has to be only run with global_scrape_data = True
 
 global_do_not_scrape = False
+# True - text columns of uploaded data are Arrow-backed strings (less memory for large exports, needs pyarrow),
+# False - python objects
+global_arrow_strings = False
+# seconds between reruns of page while titles are scraped in background
+POLL_SECONDS = 2
+
 
 def print_error():
     """"Prints error returns None"""
@@ -17,6 +29,60 @@ def print_error():
                              "received from Netflix.")
 
 
+def refresh_while_scraping():
+    """
+    Reruns page after POLL_SECONDS, timer runs in browser (streamlit-autorefresh component), so script isn't blocked
+    and widgets can be used meanwhile. Without the component progress is refreshed by button.
+    :return: None
+    """
+    if st_autorefresh is not None:
+        st_autorefresh(interval=POLL_SECONDS * 1000, key='scraping_progress')
+    else:
+        st.button('Refresh progress')
+
+
+def show_scraped_data(data: data_load.DataLoad, time_budget: float = None, provider=None):
+    """
+    Scrapes data about titles of all profiles in upload (every title once) in background job and shows analysis of
+    titles of user scraped so far. Page can be used during scraping, it is rerun until the job is finished.
+    Scraped data are saved, so next upload or switch of profile scrapes only new titles.
+    :param time_budget: seconds after which scraping stops, None - no limit
+    :param provider: MetadataProvider of metadata, None - titles are scraped from csfd.cz
+    :return: dataframe with scraped data of user
+    """
+    job = data_analysis.household_metadata_job(data.df, time_budget, provider)
+    status, metadata, finished, total = job.progress()
+    if metadata is not None:
+        # job keeps metadata in compact form
+        metadata = compact.expand(metadata)
+    if metadata is None:
+        # job hasn't looked up anything yet, metadata saved before are shown meanwhile
+        metadata = data_analysis.load_saved_metadata()
+    if metadata is None:
+        metadata = pandas.DataFrame(columns=['Split Title', 'Series'] + data_analysis.SCRAPED_COLUMNS)
+    scraped_data = data_analysis.join_scraped_data(data.df, data.name, metadata)
+    if status == jobs.RUNNING:
+        st.info("Fetching data about titles watched in your household: " + str(finished) + "/" + str(total)
+                + ". You can keep using the page, graphs below are updated as data arrive.")
+        refresh_while_scraping()
+    elif status == jobs.FAILED:
+        st.error("Fetching data about titles failed, only data fetched before the error are shown.")
+    else:
+        coverage = data_analysis.watch_time_coverage(data.df, data.name, scraped_data)
+        if coverage < 1:
+            st.info(str(int(coverage * 100)) + "% of your watch time is enriched with data from čsfd.")
+        if job.stopped():
+            # job stopped by time limit is kept until user asks for the rest of titles
+            st.button("Fetch data about remaining titles", on_click=data_analysis.household_metadata_job,
+                      args=(data.df, time_budget, provider), kwargs={'restart': True})
+    if job.collect():
+        # first run after job ended saves its result
+        data_analysis.save_metadata(metadata)
+    if not scraped_data.empty:
+        data_analysis.analyse_scraped_activity(scraped_data.copy())
+    return scraped_data
+
+
 def run():
     """
     Main cycle of all program calls function for printing out data and analyzing. Scraping data is cached so if the name
@@ -26,27 +92,46 @@ def run():
     st.title("Let's analyse your Netflix data")
     st.info("Leave/Set light background color for better readability.")
     # st.write(sys.path)
-    uploaded_file = st.file_uploader('Upload your netflix data', type='csv')
+    uploaded_files = st.file_uploader('Upload your netflix data', type=['csv', 'zip'], accept_multiple_files=True)
+    merge_history = st.checkbox("Add to previously uploaded data (only viewings that aren't saved yet are added)")
+    history = None
+    if merge_history:
+        history = st.text_input("Name of your saved data, uploads are added to data saved under the same name. Use "
+                                "name other people won't guess, anyone with the name sees your data.",
+                                type='password') or None
+        if history is None:
+            st.warning("Enter name of your saved data, until then uploads aren't added to them.")
+    time_limit = st.number_input("Maximum time of fetching data about titles in minutes (0 - no limit). Most watched "
+                                 "titles are fetched first.", min_value=0, value=0)
     a = st.radio("Do you need help with uploading data?", ['Yes', 'No'], 1)
     if a == 'No':
         pass
     else:
         st.write(
             "Download all your data from Netflix. Proccess is here: https://bitsabout.me/en/data-request-netflix/. Select "
-            "from folders netflix-report/CONTENT_INTERACTION file ViewingActivity.csv and upload it here. ")
-    data = data_load.DataLoad()
-    if uploaded_file:
-        if data.check_structure(uploaded_file):
+            "from folders netflix-report/CONTENT_INTERACTION file ViewingActivity.csv and upload it here or upload "
+            "whole zip with netflix-report as you downloaded it. More exports (e.g. downloaded at different times) can be "
+            "uploaded together, viewings that are in more of them are counted once.")
+    data = data_load.DataLoad(arrow_strings=global_arrow_strings)
+    if uploaded_files:
+        if data.check_structures(uploaded_files, history):
+            if data.added is not None:
+                st.write("New viewings added: " + str(data.added))
             if data.name != 'Select Name':
                 try:
-                    data.df = data_analysis.prepare_data(data.df)
+                    data.prepare()
+                    data_analysis.analyse_basic_activity(data.name, data.df)
                     global global_do_not_scrape
                     if global_do_not_scrape:
                         scraped_data = data_analysis.select_scraped_data(data.name)
+                        data_analysis.analyse_scraped_activity(scraped_data.copy())
+                    else:
+                        scraped_data = show_scraped_data(data, time_limit * 60 if time_limit else None)
+                    if scraped_data.empty:
+                        st.info("Information about specific titles will be shown when data about your titles are "
+                                "fetched.")
                     else:
-                        scraped_data = data_analysis.add_scraped_data(data.df, data.name)
-                    data_analysis.analyse_viewing_activity(data.name, data.df, scraped_data.copy())
-                    data_analysis.title_data(scraped_data.copy())
+                        data_analysis.title_data(scraped_data.copy())
                 except DataError:
                         print_error()
                 except ValueError:
@@ -0,0 +1,135 @@
+"""
+Benchmark of ScrapeData on saved csfd pages, no requests are sent to csfd.
+Run from directory of project: python tests/benchmark_scraping.py [--sizes 100 1000 10000] [--latency 0.05]
+Reports titles per second, parse time of one page and peak memory of start_scraping for every number of titles.
+"""
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).absolute().parent.parent))
+import argparse
+import threading
+import time
+import tracemalloc
+from collections.abc import Mapping
+import pandas as pd
+from src.scraper import scrape_data
+from src.scraper.replay import ReplaySession
+
+CORPUS = pathlib.Path(__file__).absolute().parent / 'data_for_test' / 'csfd'
+BASE_URL = 'https://www.csfd.cz'
+
+
+class SyntheticPages(Mapping):
+    """ Pages for titles 'Bench Title <number>' made from saved pages when they are requested. """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.search_template = (CORPUS / 'search-400003-superstore.html').read_text(encoding='utf-8')
+        self.film_pages = sorted(CORPUS.glob('film-*.html'))
+        self.film_pages = [page.read_bytes() for page in self.film_pages]
+
+    def number(self, url: str):
+        if url.startswith(BASE_URL + '/hledat/?q=Bench+Title+'):
+            return 'search', int(url.rsplit('+', 1)[1])
+        if url.startswith(BASE_URL + '/film/') and url.endswith('-bench/'):
+            return 'film', int(url[len(BASE_URL + '/film/'):-len('-bench/')])
+        return None, None
+
+    def __getitem__(self, url: str):
+        kind, number = self.number(url)
+        if kind is None or not 0 <= number < self.size:
+            raise KeyError(url)
+        if kind == 'search':
+            page = self.search_template.replace('/film/400003-superstore/', '/film/' + str(number) + '-bench/')
+            return page.replace('Superstore', 'Bench Title ' + str(number)).encode()
+        return self.film_pages[number % len(self.film_pages)]
+
+    def __contains__(self, url):
+        try:
+            self[url]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for number in range(self.size):
+            yield BASE_URL + '/hledat/?q=Bench+Title+' + str(number)
+            yield BASE_URL + '/film/' + str(number) + '-bench/'
+
+    def __len__(self):
+        return 2 * self.size
+
+
+class ParseTimer:
+    """ Measures time spent in parsing functions used by ScrapeData. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = 0.0
+        self.pages = 0
+        self.originals = {}
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds += time.perf_counter() - start
+                    self.pages += 1
+        return timed
+
+    def __enter__(self):
+        for name in ['parse_search_page', 'parse_film_page']:
+            self.originals[name] = getattr(scrape_data, name)
+            setattr(scrape_data, name, self.wrap(self.originals[name]))
+        return self
+
+    def __exit__(self, *args):
+        for name, function in self.originals.items():
+            setattr(scrape_data, name, function)
+
+
+def run(size: int, args, trace_memory: bool = False):
+    """
+    Scrapes size titles from synthetic pages.
+    :return: seconds of scraping, ParseTimer, peak memory in bytes (0 if not traced)
+    """
+    titles = pd.DataFrame({'Title': ['Bench Title ' + str(number) for number in range(size)], 'Series': True})
+    session = ReplaySession(SyntheticPages(size), latency=args.latency, error_rate=args.error_rate, seed=0)
+    scraper = scrape_data.ScrapeData(titles, requests_per_second=args.rps, max_workers=args.workers,
+                                     max_per_host=args.workers, session=session)
+    if trace_memory:
+        tracemalloc.start()
+    with ParseTimer() as timer:
+        start = time.perf_counter()
+        scraper.start_scraping()
+        scraper.get_scraped_data()
+        seconds = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, timer, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency of every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of request with status 503')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rps', type=float, default=1e6, help='requests per second of rate limiter')
+    args = parser.parse_args()
+    print('{:>8} {:>12} {:>16} {:>16}'.format('titles', 'titles/s', 'parse ms/page', 'peak memory MB'))
+    for size in args.sizes:
+        seconds, timer, _ = run(size, args)
+        _, _, peak = run(size, args, trace_memory=True)
+        print('{:>8} {:>12.1f} {:>16.3f} {:>16.1f}'.format(size, size / seconds,
+                                                           1000 * timer.seconds / max(1, timer.pages),
+                                                           peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
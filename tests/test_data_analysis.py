@@ -1,9 +1,14 @@
+import io
+import collections
 import sys
+import time
 import pathlib
+import zipfile
+from datetime import datetime
 sys.path.append(str(pathlib.Path().absolute()).split("/tests")[0])
 import pytest
 import pandas as pd
-from src.data_analysis import data_analysis, data_analysis_subtasks
+from src.data_analysis import data_analysis, data_analysis_subtasks, data_load, compact, chunked
 
 
 path = str(pathlib.Path().absolute()).split("/tests")[0] + "/"
@@ -190,6 +195,15 @@ def test_years_of_genre(cor_data, genre):
     assert (cor_data.equals(result))
 
 
+def test_years_of_genre_user():
+    result = data_analysis.years_of_genre_user(scraped_data, 'Komedie')
+    years = data_analysis_subtasks.add_time_features(scraped_data)['Year']
+    assert (list(result['Year']) == list(range(years.min(), years.max() + 1)))
+    expected = [sum(data_analysis_subtasks.is_genre_in_str('Komedie', genres) and watched == year
+                    for genres, watched in zip(scraped_data['Genre'], years)) for year in result['Year']]
+    assert (list(result['Genre watched']) == expected)
+
+
 @pytest.mark.parametrize(
     ['genre', 'genres', 'expected'],
     [('Komedie', 'Komedie', True),
@@ -287,4 +301,259 @@ def test_data_country_timeline():
     correct_result['Date'] = correct_result['Date'].apply(str)
     result['Date'] = result['Date'].apply(str)
     pd.util.testing.assert_frame_equal(result, correct_result, check_names=False)
-    assert (result.equals(correct_result))
\ No newline at end of file
+    assert (result.equals(correct_result))
+
+
+def test_prepare_data():
+    raw = pd.read_csv(path + 'tests/data_for_test/ViewingActivity1.csv')
+    result = data_analysis.prepare_data(raw)
+    assert (pd.api.types.is_timedelta64_dtype(result.Duration))
+    assert (pd.api.types.is_datetime64_any_dtype(result['Start Time']))
+    expected = raw.Duration.apply(data_analysis_subtasks.make_delta)
+    assert (result.Duration.equals(expected[expected > pd.Timedelta(minutes=5)]))
+    for start, date, year, month, weekday, hour, second in zip(raw.loc[result.index, 'Start Time'], result.Date,
+                                                               result.Year, result.Month, result.Weekday, result.Hour,
+                                                               result['Second Of Day']):
+        start = datetime.strptime(start, data_analysis_subtasks.TIME_FORMAT)
+        assert ((date, year, month, weekday, hour) == (start.date(), start.year, start.month, start.weekday(),
+                                                       start.hour))
+        assert (second == start.hour * 3600 + start.minute * 60 + start.second)
+    unprepared = raw.loc[result.index].assign(Duration=result.Duration)
+    assert (data_analysis.watching_habit_days(result).equals(data_analysis.watching_habit_days(unprepared)))
+
+
+@pytest.mark.parametrize('pyarrow_csv', [data_load.pyarrow_csv, None])
+def test_read_viewing_activity(monkeypatch, pyarrow_csv):
+    monkeypatch.setattr(data_load, 'pyarrow_csv', pyarrow_csv)
+    with open(path + 'tests/data_for_test/ViewingActivity3.csv', 'rb') as file:
+        assert (data_load.REQUIRED_COLUMNS.issubset(data_load.read_header(file)))
+        result = data_load.read_viewing_activity(file)
+    expected = pd.read_csv(path + 'tests/data_for_test/ViewingActivity3.csv')[data_load.USED_COLUMNS]
+    assert (list(result.columns) == data_load.USED_COLUMNS)
+    assert (result['Profile Name'].dtype == 'category' and result['Country'].dtype == 'category')
+    assert (list(result['Country'].cat.categories) == sorted(expected['Country'].unique()))
+    pd.util.testing.assert_frame_equal(result.astype(object), expected.astype(object))
+
+
+def test_cached_upload(monkeypatch, tmp_path):
+    if data_load.feather is None:
+        pytest.skip('pyarrow is not installed')
+    monkeypatch.setattr(data_load, 'cached_upload_path', lambda fingerprint: tmp_path / (fingerprint + '.feather'))
+    with open(path + 'tests/data_for_test/ViewingActivity3.csv', 'rb') as file:
+        upload = io.BytesIO(file.read())
+    upload.name = 'ViewingActivity.csv'
+    first = data_load.DataLoad()
+    assert (first.check_structure(upload) and not first.prepared)
+    first.prepare()
+
+    def no_parsing(file):
+        raise AssertionError('saved upload should not be parsed')
+    monkeypatch.setattr(data_load, 'read_viewing_activity', no_parsing)
+    second = data_load.DataLoad()
+    assert (second.check_structure(upload) and second.prepared)
+    assert (second.fingerprint == first.fingerprint)
+    second.prepare()
+    pd.util.testing.assert_frame_equal(second.df, first.df)
+
+
+def test_cached_upload_in_memory(monkeypatch):
+    monkeypatch.setattr(data_load, 'feather', None)
+    monkeypatch.setattr(data_load, 'memory_uploads', collections.OrderedDict())
+    monkeypatch.setattr(data_load, 'MEMORY_UPLOADS_SIZE', 1)
+    with open(path + 'tests/data_for_test/ViewingActivity3.csv', 'rb') as file:
+        upload = io.BytesIO(file.read())
+    upload.name = 'ViewingActivity.csv'
+    first = data_load.DataLoad()
+    assert (first.check_structure(upload) and not first.prepared)
+    first.prepare()
+    second = data_load.DataLoad()
+    assert (second.check_structure(upload) and second.prepared)
+    pd.util.testing.assert_frame_equal(second.df, first.df)
+    data_load.save_cached_upload('other', first.df)
+    assert (list(data_load.memory_uploads) == ['other'])
+
+
+def test_upload_cache_eviction(monkeypatch, tmp_path):
+    if data_load.feather is None:
+        pytest.skip('pyarrow is not installed')
+    monkeypatch.setattr(data_load, 'cached_upload_path',
+                        lambda fingerprint: tmp_path / ('upload-' + fingerprint + '.feather'))
+    monkeypatch.setattr(data_load, 'UPLOAD_CACHE_SIZE', 2)
+    data = data_analysis.prepare_data(viewing_act)
+    for fingerprint in ['a', 'b', 'c']:
+        data_load.save_cached_upload(fingerprint, data)
+        time.sleep(0.01)
+    assert (sorted(file.name for file in tmp_path.iterdir()) == ['upload-b.feather', 'upload-c.feather'])
+    data_load.load_cached_upload('b')
+    time.sleep(0.01)
+    data_load.save_cached_upload('d', data)
+    assert (sorted(file.name for file in tmp_path.iterdir()) == ['upload-b.feather', 'upload-d.feather'])
+
+
+def test_netflix_archive(monkeypatch, tmp_path):
+    monkeypatch.setattr(data_load, 'cached_upload_path', lambda fingerprint: tmp_path / (fingerprint + '.feather'))
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path + 'tests/data_for_test/ViewingActivity3.csv',
+                      'netflix-report/CONTENT_INTERACTION/ViewingActivity.csv')
+        archive.writestr('netflix-report/CLICKSTREAM/Clickstream.csv', 'Profile Name,Source\nDaniel,tv\n')
+        archive.writestr('netflix-report/Cover sheet.pdf', b'%PDF' + bytes(1000))
+    upload.name = 'netflix-report.zip'
+    opened = []
+    files = []
+    open_member = data_load.NetflixArchive.open
+
+    def open_recorded(self, member):
+        opened.append(member)
+        files.append(open_member(self, member))
+        return files[-1]
+    monkeypatch.setattr(data_load.NetflixArchive, 'open', open_recorded)
+    data = data_load.DataLoad()
+    assert (data.check_structure(upload))
+    assert (opened == ['netflix-report/CONTENT_INTERACTION/ViewingActivity.csv'])
+    assert (all(file.closed for file in files) and not upload.closed)
+    with open(path + 'tests/data_for_test/ViewingActivity3.csv', 'rb') as file:
+        expected = data_load.read_viewing_activity(file)
+    pd.util.testing.assert_frame_equal(data.df, expected)
+    clickstream = data.archive.read_csv('CLICKSTREAM/Clickstream.csv')
+    assert (data.archive.read_csv('CLICKSTREAM/Clickstream.csv') is clickstream)
+    assert (list(clickstream['Source']) == ['tv'])
+    assert (data.archive.read_csv('CONTENT_INTERACTION/MyList.csv') is None)
+    assert ('netflix-report/Cover sheet.pdf' not in opened)
+
+
+@pytest.mark.parametrize('data', [data_analysis_subtasks.add_time_features(scraped_data),
+                                  data_analysis.prepare_data(pd.read_csv(
+                                      path + 'netflix-report/CONTENT_INTERACTION/ViewingActivity.csv'))])
+def test_compact(data):
+    small = compact.compact(data)
+    assert ('Date' not in small.columns and small['Duration Seconds'].dtype == 'int32')
+    assert (small['Title'].dtype == 'category')
+    pd.util.testing.assert_frame_equal(compact.expand(small), data)
+    report = compact.memory_report(small)
+    assert (report['Column'].iloc[-1] == 'Total')
+    assert (report['Bytes'].iloc[-1] == small.memory_usage(deep=True).sum())
+    assert (report['Bytes'].iloc[-1] < compact.memory_report(data)['Bytes'].iloc[-1])
+
+
+def test_merge_viewing_activity(monkeypatch, tmp_path):
+    with open(path + 'netflix-report/CONTENT_INTERACTION/ViewingActivity.csv', 'rb') as file:
+        export = data_load.read_viewing_activity(file)
+    older = export[export['Start Time'] < '2021-09-01']
+    stored = data_analysis.prepare_data(older.copy())
+    prepared = []
+    prepare_data = data_analysis.prepare_data
+    monkeypatch.setattr(data_analysis, 'prepare_data', lambda data: prepared.append(len(data)) or prepare_data(data))
+    merged, added = data_load.merge_viewing_activity(stored, export)
+    # only new viewings (and short viewings after the last stored one, prepare_data drops them) are prepared
+    assert (len(prepared) == 1 and len(export) - len(older) <= prepared[0] < 2 * (len(export) - len(older)))
+    expected = prepare_data(export.copy())
+    assert (len(added) == len(expected) - len(stored))
+
+    def by_key(data):
+        return data.sort_values(data_load.KEY_COLUMNS + ['Duration']).reset_index(drop=True)
+    pd.util.testing.assert_frame_equal(by_key(merged), by_key(expected))
+    again, added = data_load.merge_viewing_activity(merged, export)
+    assert (added.empty and len(again) == len(merged))
+    _, added = data_load.merge_viewing_activity(merged, older, append_only=False)
+    assert (added.empty)
+
+    monkeypatch.setattr(data_load, 'cached_upload_path', lambda fingerprint: tmp_path / (fingerprint + '.feather'))
+    monkeypatch.setattr(data_load, 'history_path', lambda history: tmp_path / (history + '.feather'))
+    monkeypatch.setattr(data_load, 'merged_uploads', collections.OrderedDict())
+    uploads = []
+    for rows in [older, export]:
+        upload = io.BytesIO()
+        rows.assign(**{column: '' for column in data_load.REQUIRED_COLUMNS - set(rows.columns)}).to_csv(upload,
+                                                                                                        index=False)
+        upload.name = 'ViewingActivity.csv'
+        uploads.append(upload)
+    data = data_load.DataLoad()
+    assert (data.check_structures(uploads) and data.prepared and data.added == len(expected))
+    pd.util.testing.assert_frame_equal(by_key(data.df), by_key(expected))
+    if data_load.feather is not None:
+        # every export was prepared and saved, so next upload of it isn't parsed
+        assert (len(list(tmp_path.glob('*.feather'))) == len(uploads))
+        first = data_load.DataLoad()
+        assert (first.check_structures(uploads[:1], history='first') and first.added == len(stored))
+        saved = []
+        save_history = data_load.save_history
+        monkeypatch.setattr(data_load, 'save_history', lambda history, data: saved.append(history) or
+                            save_history(history, data))
+        for _ in range(2):
+            # rerun of page with same uploads doesn't merge them again
+            second = data_load.DataLoad()
+            assert (second.check_structures(uploads[1:], history='first'))
+            assert (second.added == len(expected) - len(stored) and saved == ['first'])
+            pd.util.testing.assert_frame_equal(by_key(second.df), by_key(expected))
+        other = data_load.DataLoad()
+        assert (other.check_structures(uploads[:1], history='other') and other.added == len(stored))
+        pd.util.testing.assert_frame_equal(by_key(other.df), by_key(stored))
+
+
+def test_arrow_strings(monkeypatch, tmp_path):
+    if data_load.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+    monkeypatch.setattr(data_load, 'cached_upload_path', lambda fingerprint: tmp_path / (fingerprint + '.feather'))
+    with open(path + 'netflix-report/CONTENT_INTERACTION/ViewingActivity.csv', 'rb') as file:
+        upload = io.BytesIO(file.read())
+    upload.name = 'ViewingActivity.csv'
+    frames = []
+    for arrow_strings in [False, True, True]:
+        data = data_load.DataLoad(arrow_strings)
+        assert (data.check_structure(upload))
+        data.prepare()
+        frames.append(data.df)
+    default, arrow, saved = frames
+    for data in [arrow, saved]:
+        assert (all(data[column].dtype == data_load.ARROW_STRING for column in ['Profile Name', 'Title', 'Country']))
+        assert (data.memory_usage(deep=True).sum() < default.memory_usage(deep=True).sum())
+
+    def same(result, expected):
+        if isinstance(result, pd.DataFrame):
+            result, expected = result.reset_index(), expected.reset_index()
+            pd.util.testing.assert_frame_equal(result.astype(object), expected.astype(object), check_dtype=False)
+        else:
+            pd.util.testing.assert_series_equal(result.astype(object), expected.astype(object), check_dtype=False,
+                                                check_index_type=False, check_categorical=False)
+    assert (sorted(data_analysis.analyse_users(arrow)) == sorted(data_analysis.analyse_users(default)))
+    daniel, arrow_daniel = default[default['Profile Name'] == 'Daniel'], arrow[arrow['Profile Name'] == 'Daniel']
+    assert (data_analysis.hours_watched(arrow_daniel) == data_analysis.hours_watched(daniel))
+    assert (data_analysis_subtasks.position_in_family_watching(arrow, 'Daniel') ==
+            data_analysis_subtasks.position_in_family_watching(default, 'Daniel'))
+    same(data_analysis.split_titles(arrow), data_analysis.split_titles(default))
+    same(data_analysis.titles_by_watch_time(data_analysis.split_titles(arrow_daniel)),
+         data_analysis.titles_by_watch_time(data_analysis.split_titles(daniel)))
+    same(data_analysis_subtasks.most_common_watched_titles(arrow, True, True),
+         data_analysis_subtasks.most_common_watched_titles(default, True, True))
+    same(data_analysis_subtasks.get_time_table(arrow_daniel), data_analysis_subtasks.get_time_table(daniel))
+    same(data_analysis.analyze_country(arrow_daniel, 'Country'), data_analysis.analyze_country(daniel, 'Country'))
+
+
+def test_chunked_aggregates(tmp_path):
+    export = pd.read_csv(path + 'netflix-report/CONTENT_INTERACTION/ViewingActivity.csv').iloc[::10]
+    export.to_csv(tmp_path / 'ViewingActivity.csv', index=False)
+    files = [tmp_path / 'ViewingActivity.csv', path + 'tests/data_for_test/ViewingActivity0.csv']
+    aggregates = chunked.aggregate_viewing_activity(files, chunk_size=100)
+    data = data_analysis.prepare_data(pd.concat([export, pd.read_csv(files[1])], ignore_index=True))
+    assert (sorted(aggregates.users()) == sorted(data_analysis.analyse_users(data)))
+    for name in aggregates.users():
+        user = data[data['Profile Name'] == name]
+        assert (aggregates.position_in_family_watching(name) ==
+                data_analysis_subtasks.position_in_family_watching(data, name))
+        assert (aggregates.hours_watched(name) == data_analysis.hours_watched(user))
+        assert (aggregates.times_watched(name) == data_analysis.times_watched(user))
+        assert (aggregates.avarage_time_spent_watching(name) ==
+                pytest.approx(data_analysis.avarage_time_spent_watching(user, len(user))))
+        assert (aggregates.max_time_watched_session(name) == data_analysis.max_time_watched_session(user))
+        assert (aggregates.max_time_watched_day(name) == data_analysis.max_time_watched_day(user))
+        pd.util.testing.assert_frame_equal(aggregates.watching_habit_days(name),
+                                           data_analysis.watching_habit_days(user))
+        pd.util.testing.assert_frame_equal(aggregates.watching_habit_months(name),
+                                           data_analysis.watching_habit_months(user))
+        pd.util.testing.assert_frame_equal(aggregates.watching_habit_timeline(name),
+                                           data_analysis.watching_habit_timeline(user))
+        pd.util.testing.assert_frame_equal(aggregates.get_time_table(name), data_analysis_subtasks.get_time_table(user),
+                                           check_dtype=False)
+        pd.util.testing.assert_frame_equal(aggregates.analyze_country(name),
+                                           data_analysis.analyze_country(user, 'Country'))
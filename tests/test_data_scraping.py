@@ -1,9 +1,23 @@
 import sys
+import json
 import pathlib
+import time
+import threading
+import sqlite3
 sys.path.append(str(pathlib.Path().absolute()).split("/tests")[0])
+import pytest
 import pandas as pd
-from src.data_analysis import data_analysis, data_analysis_subtasks
+from src.data_analysis import data_analysis, data_analysis_subtasks, data_load, compact
 from src.scraper.scrape_data import ScrapeData
+from src.scraper.rate_limit import RateLimiter, CSFD_LIMITER
+from src.scraper.metadata_store import MetadataStore
+from src.scraper import csfd_parser, checkpoint, jobs, providers, metadata_store
+from src.scraper.checkpoint import ScrapeJournal
+from src.scraper.replay import ReplaySession
+from src.scraper.providers import OfflineProvider
+from src.scraper.single_flight import SingleFlight
+from src.scraper.page_store import PageStore
+from src.web_app import front_page
 
 path = str(pathlib.Path().absolute()).split("/tests")[0] + "/"
 
@@ -50,6 +64,13 @@ scrape_data_result = pd.DataFrame({'Title': pd.Series(['Father Hood', 'The Shaws
                                    })
 
 
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    """Cache directory of project (store, journals, saved uploads) is replaced by temporary directory."""
+    monkeypatch.setattr(metadata_store, 'cache_path', lambda file_name: tmp_path / file_name)
+    return tmp_path
+
+
 def test_data_scraping():
     """Test for scraper class ScrapeData. """
     scraper = ScrapeData(viewing_data_input)
@@ -58,18 +79,474 @@ def test_data_scraping():
     assert (scraper.scraped_table.equals(scrape_data_result))
 
 
+def test_data_scraping_replay():
+    """Test for scraper class ScrapeData on saved csfd pages, without requests to csfd."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd')
+    scraper = ScrapeData(viewing_data_input, requests_per_second=1000, session=session)
+    scraper.start_scraping()
+    pd.util.testing.assert_frame_equal(scraper.scraped_table, scrape_data_result)
+    assert (session.requests == 17)
+
+
+def test_data_scraping_replay_errors():
+    """Titles with failed requests stay empty and are marked as failed."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd', error_rate=1)
+    scraper = ScrapeData(viewing_data_input, requests_per_second=1000, session=session)
+    scraper.start_scraping()
+    assert (set(scraper.statuses.values()) == {checkpoint.FAILED})
+    assert ((scraper.scraped_table['Year Start'] == -1).all())
+
+
 dataForScraping = pd.read_csv(path + 'tests/data_for_test/data_add_scraped_data.csv')
 
 
-def test_add_scraped_data():
+def read_scraped_result():
+    """Expected result of add_scraped_data for dataForScraping, with columns added by prepare_data."""
+    result = pd.read_csv(path + 'tests/data_for_test/result_add_scraped_data.csv')
+    result.Duration = result.Duration.apply(data_analysis_subtasks.make_delta)
+    return data_analysis_subtasks.add_time_features(result)
+
+
+def test_add_scraped_data(cache):
     """Test for starting scraping and connecting scraped data (scraping tested in function above) with regular
     - fuction in data_analysis  add_scraped_data
     """
     data = data_analysis.prepare_data(dataForScraping)
     data = data_analysis.add_scraped_data(data, 'Daniel')
-    result = pd.read_csv(path + 'tests/data_for_test/result_add_scraped_data.csv')
-    result.Duration = result.Duration.apply(data_analysis_subtasks.make_delta)
-    pd.util.testing.assert_frame_equal(data, result)
-    assert (data.equals(result))
+    result = read_scraped_result()
+    pd.util.testing.assert_frame_equal(data[result.columns], result)
+    assert (data[result.columns].equals(result))
+
+
+def test_rate_limiter_budget():
+    """Rate limiter lets through burst at once and then only requests_per_second requests."""
+    limiter = RateLimiter(requests_per_second=50, burst=1, max_per_host=2)
+    start = time.monotonic()
+    for _ in range(11):
+        with limiter.slot('https://www.csfd.cz/hledat/?q=a'):
+            pass
+    assert (time.monotonic() - start >= 10 / 50 * 0.9)
+
+
+def test_rate_limiter_host_cap():
+    """At most max_per_host requests are in flight to one host."""
+    limiter = RateLimiter(requests_per_second=1000, burst=100, max_per_host=2)
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def request():
+        with limiter.slot('https://www.csfd.cz/film/1'):
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (max(peak) == 2)
+
+
+def test_metadata_store(tmp_path):
+    """Saved titles are found by normalized name and series flag and expire after ttl."""
+    record = {'Year Start': 2015, 'Year End': 2021, 'Genre': 'Komedie', 'Country': 'USA',
+              'Actors': 'America Ferrera,Ben Feldman', 'Rating': 75}
+    store = MetadataStore(tmp_path / 'metadata.sqlite')
+    store.put('Superstore', True, record)
+    assert (store.get('  superstore ', True) == record)
+    assert (store.get('Superstore', False) is None)
+    store.close()
+    store = MetadataStore(tmp_path / 'metadata.sqlite', ttl=-1)
+    assert (store.get('Superstore', True) is None)
+
+
+film_page = ('<html><body><nav><a href="/">Domů</a></nav><div class="film-rating"><div class="rating-average">'
+             '77%</div></div><div class="film-info-content"><div class="genres">Drama / Romantický</div>'
+             '<div class="origin">USA, 2019, 135 min</div><div><h4>Režie: </h4><a href="/d">Greta Gerwig</a></div>'
+             '<div><h4>Hrají: </h4><a href="/1">Saoirse Ronan</a>, <a href="/2">Emma Watson</a>, '
+             '<a href="/3">Florence Pugh</a>, <a href="/4">Eliza Scanlen</a>, <a href="/5">Laura Dern</a>, '
+             '<a href="/6">Timothée Chalamet</a></div></div><div class="box-comment">Komentář</div></body></html>')
+
+search_page = ('<html><body><section class="box main-movies"><article><header class="article-header">'
+               '<h3><a href="/film/1-malé-ženy/" class="film-title-name">Malé ženy</a></h3>'
+               '<p class="search-name">(Little Women)</p></header></article></section>'
+               '<section class="box main-series"><article><header class="article-header">'
+               '<h3><a href="/film/2-superstore/" class="film-title-name">Superstore</a></h3></header>'
+               '</article></section></body></html>')
+
+
+@pytest.mark.parametrize(
+    ['page'],
+    [(film_page,),
+     (film_page.replace('<div class="film-rating">', '<style>.rating-average {}</style><div class="film-rating">'),),
+     (film_page.encode(),)])
+def test_parse_film_page(page):
+    record = csfd_parser.parse_film_page(page)
+    assert (record == csfd_parser.FilmRecord(2019, 2019, 'Drama,Romantický', 'USA',
+                                             'Saoirse Ronan,Emma Watson,Florence Pugh,Eliza Scanlen,Laura Dern', 77))
+
+
+@pytest.mark.parametrize('origin', ['USA', 'USA, neuvedeno, 135 min'])
+def test_parse_film_page_malformed_origin(origin):
+    """Title with origin without year can't be parsed, scraping marks it as failed."""
+    with pytest.raises(ValueError):
+        csfd_parser.parse_film_page(film_page.replace('USA, 2019, 135 min', origin))
+
+
+@pytest.mark.parametrize(
+    ['title', 'series', 'expected'],
+    [('Little Women', False, '/film/1-malé-ženy/'),
+     ('Malé ženy', False, '/film/1-malé-ženy/'),
+     ('Superstore', True, '/film/2-superstore/'),
+     ('Superstore', False, None)])
+def test_parse_search_page(title, series, expected):
+    assert (csfd_parser.parse_search_page(search_page.encode(), title, series) == expected)
+
+
+def test_shared_rate_limiter():
+    """Scrapings of csfd.cz share process-wide limiter, scrapings with own session, rate or limiter don't."""
+    assert (ScrapeData(viewing_data_input).limiter is CSFD_LIMITER)
+    own = ScrapeData(viewing_data_input, requests_per_second=1000).limiter
+    assert (own is not CSFD_LIMITER and own.rate == 1000)
+    own = ScrapeData(viewing_data_input, max_per_host=1, session=NoNetworkSession()).limiter
+    assert (own is not CSFD_LIMITER and own.max_per_host == 1 and own.rate == CSFD_LIMITER.rate)
+    limiter = RateLimiter(requests_per_second=5)
+    assert (ScrapeData(viewing_data_input, limiter=limiter).limiter is limiter)
+    with pytest.raises(ValueError):
+        ScrapeData(viewing_data_input, requests_per_second=1000, limiter=limiter)
+
+
+class NoNetworkSession:
+    """Session that fails test if scraper makes any request."""
+
+    def get(self, url, headers=None):
+        raise AssertionError('Unexpected request ' + url)
+
+
+def test_resume_from_journal(tmp_path):
+    """Titles that journal has as scraped or not found are not requested again."""
+    journal = ScrapeJournal(tmp_path / 'checkpoint.jsonl')
+    record = {'Year Start': 2013, 'Year End': 2021, 'Genre': 'Komedie,Krimi', 'Country': 'USA',
+              'Actors': 'Andy Samberg,Stephanie Beatriz,Terry Crews,Joe Lo Truglio,Melissa Fumero', 'Rating': 84}
+    journal.write('Brooklyn Nine-Nine', True, checkpoint.DONE, record)
+    journal.write('fasdfa', False, checkpoint.FAILED)
+    journal.write('fasdfa', False, checkpoint.NOT_FOUND)
+    with open(journal.path, 'a', encoding='utf-8') as file:
+        file.write('{"title": "cut li')
+    scraper = ScrapeData(viewing_data_input.iloc[[6, 8]], journal=journal)
+    scraper.session = NoNetworkSession()
+    scraper.start_scraping()
+    pd.util.testing.assert_frame_equal(scraper.scraped_table, scrape_data_result.iloc[[6, 8]])
+    assert (scraper.statuses == {'Brooklyn Nine-Nine': checkpoint.DONE, 'fasdfa': checkpoint.NOT_FOUND})
+
+
+def test_journal_after_cut_line(tmp_path):
+    """Line written after cut last line of killed scraping is not glued to it."""
+    journal = ScrapeJournal(tmp_path / 'checkpoint.jsonl')
+    journal.write('Superstore', True, checkpoint.NOT_FOUND)
+    with open(journal.path, 'a', encoding='utf-8') as file:
+        file.write('{"title": "cut li')
+    journal = ScrapeJournal(tmp_path / 'checkpoint.jsonl')
+    journal.write('fasdfa', False, checkpoint.NOT_FOUND)
+    assert (set(journal.load()) == {('Superstore', True), ('fasdfa', False)})
+
+
+def test_saved_urls(tmp_path):
+    """Second scraping of titles uses saved urls and doesn't request search pages."""
+    store = MetadataStore(tmp_path / 'metadata.sqlite', ttl=-1)
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd')
+    ScrapeData(viewing_data_input, requests_per_second=1000, store=store, session=session).start_scraping()
+    assert (store.get_url('fasdfa', False) == (True, None))
+    assert (store.get_url('Superstore', True) == (True, '/film/400003-superstore/'))
+    session.requests = 0
+    scraper = ScrapeData(viewing_data_input, requests_per_second=1000, store=store, session=session)
+    scraper.start_scraping()
+    pd.util.testing.assert_frame_equal(scraper.scraped_table, scrape_data_result)
+    assert (session.requests == 8)
+    store.close()
+    store = MetadataStore(tmp_path / 'metadata.sqlite', not_found_ttl=-1)
+    assert (store.get_url('fasdfa', False) == (False, None))
+    assert (store.get_url('Superstore', True) == (True, '/film/400003-superstore/'))
 
 
+def test_add_scraped_data_incremental(cache):
+    """Titles that are in previous scraped data are not scraped again."""
+    data = data_analysis.prepare_data(dataForScraping)
+    previous = read_scraped_result()
+    data = data_analysis.add_scraped_data(data, 'Daniel', previous.iloc[:1].append(previous))
+    pd.util.testing.assert_frame_equal(data[previous.columns], previous)
+
+
+def test_scraping_time_budget():
+    """Scraping stops after time budget, titles are scraped in order of table."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd', latency=0.1)
+    scraper = ScrapeData(viewing_data_input.iloc[::-1], requests_per_second=1000, max_workers=1, session=session,
+                         time_budget=0.3)
+    scraper.start_scraping()
+    assert (scraper.deadline_reached)
+    assert (0 < len(scraper.statuses) < 9)
+    assert (list(scraper.statuses) == list(viewing_data_input.Title.iloc[::-1].iloc[:len(scraper.statuses)]))
+
+
+def test_titles_by_watch_time():
+    data = data_analysis.split_titles(data_analysis.prepare_data(dataForScraping))
+    titles = data_analysis.titles_by_watch_time(data)
+    assert (titles.Title.iloc[0] == "The Huntsman: Winter's War")
+    assert (titles.Duration.is_monotonic_decreasing)
+    assert (len(titles) == len(data[['Split Title', 'Series']].drop_duplicates()))
+
+
+def test_household_metadata(cache):
+    """Titles shared by profiles are in metadata once and joined to every profile without scraping."""
+    daniel = data_analysis.prepare_data(dataForScraping)
+    kokos = daniel.iloc[::2].assign(**{'Profile Name': 'Kokos'})
+    data = pd.concat([daniel, kokos], ignore_index=True)
+    previous = read_scraped_result()
+    metadata = data_analysis.household_metadata(data, previous)
+    assert (not metadata.duplicated(['Split Title', 'Series']).any())
+    pd.util.testing.assert_frame_equal(data_analysis.join_scraped_data(data, 'Daniel', metadata)[previous.columns],
+                                       previous)
+    scraped = data_analysis.join_scraped_data(data, 'Kokos', metadata)
+    assert (set(scraped['Profile Name']) == {'Kokos'})
+    assert (set(scraped['Split Title']) <= set(previous['Split Title']))
+
+
+def test_save_metadata(monkeypatch, tmp_path):
+    """Saving metadata of one session keeps titles saved by other sessions."""
+    monkeypatch.setattr(data_analysis, 'saved_metadata_path', lambda: tmp_path / 'titles_metadata.csv')
+    metadata = data_analysis.titles_metadata(read_scraped_result()).reset_index(drop=True)
+    data_analysis.save_metadata(metadata.iloc[:3])
+    data_analysis.save_metadata(metadata.iloc[2:])
+    data_analysis.save_metadata(metadata.iloc[:1])
+    saved = data_analysis.load_saved_metadata()
+    key = ['Split Title', 'Series']
+    pd.util.testing.assert_frame_equal(saved.sort_values(key).reset_index(drop=True),
+                                       metadata.sort_values(key).reset_index(drop=True), check_dtype=False)
+
+
+def test_job_queue():
+    """Job runs in background, same key returns same job and failed job is reported."""
+    queue = jobs.JobQueue()
+    release = threading.Event()
+
+    def batches():
+        yield 'first', 1, 2
+        release.wait(5)
+        yield 'second', 2, 2
+
+    job = queue.submit('upload', batches)
+    assert (queue.submit('upload', batches) is job)
+    while job.progress()[2] == 0:
+        time.sleep(0.01)
+    assert (job.progress() == (jobs.RUNNING, 'first', 1, 2))
+    release.set()
+    job.future.result(5)
+    assert (job.progress() == (jobs.FINISHED, 'second', 2, 2))
+
+    def failing():
+        raise ValueError('page changed')
+        yield
+    failed = queue.submit('other', failing)
+    failed.future.result(5)
+    assert (failed.status == jobs.FAILED and isinstance(failed.error, ValueError))
+    assert (queue.submit('other', batches) is not failed)
+    queue.remove(job.job_id)
+    assert (queue.get(job.job_id) is None)
+
+    def stopped_by_time_limit():
+        yield 'part', 1, 2
+    stopped = queue.submit('limited', stopped_by_time_limit)
+    stopped.future.result(5)
+    assert (stopped.status == jobs.FINISHED and stopped.stopped())
+    assert (stopped.collect() and not stopped.collect())
+    # stopped job continues only when it is restarted
+    assert (queue.submit('limited', stopped_by_time_limit) is stopped)
+    assert (queue.submit('limited', stopped_by_time_limit, restart=True) is not stopped)
+
+    short = jobs.JobQueue(ttl=0)
+    ended = short.submit('upload', lambda: iter([('result', 1, 1)]))
+    stopped = short.submit('limited', stopped_by_time_limit)
+    ended.future.result(5)
+    stopped.future.result(5)
+    stopped.collect()
+    time.sleep(0.01)
+    assert (short.get(ended.job_id) is None and short.submit('upload', batches) is not ended)
+    assert (short.submit('limited', stopped_by_time_limit) is stopped and stopped.result is None)
+
+
+def offline_provider():
+    """OfflineProvider with metadata of all titles of read_scraped_result."""
+    dump = data_analysis.titles_metadata(read_scraped_result()).rename(columns={
+        'Split Title': 'title', 'Series': 'series', 'Year Start': 'year_start', 'Year End': 'year_end',
+        'Genre': 'genres', 'Country From': 'country', 'Actors': 'actors', 'Rating': 'rating'})
+    return OfflineProvider.from_table(dump)
+
+
+def test_household_metadata_job(monkeypatch, tmp_path):
+    """Background job gives same metadata as household_metadata, page saves them when job ends."""
+    monkeypatch.setattr(data_analysis, 'saved_metadata_path', lambda: tmp_path / 'titles_metadata.csv')
+    data = data_analysis.prepare_data(dataForScraping)
+    provider = offline_provider()
+    job = data_analysis.household_metadata_job(data, None, provider)
+    while not job.done():
+        time.sleep(0.01)
+    status, metadata, finished, total = job.progress()
+    assert (status == jobs.FINISHED and finished == total)
+    expected = data_analysis.household_metadata(data, None, None, provider)
+    assert (metadata['Genre'].dtype == 'category')
+    pd.util.testing.assert_frame_equal(compact.expand(metadata), expected)
+    # metadata saved by other session don't start another job for same upload
+    data_analysis.save_metadata(expected.iloc[:1])
+    assert (data_analysis.household_metadata_job(data, None, provider) is job)
+    assert (data_analysis.household_metadata_job(data, 60, provider) is not job)
+    assert (data_analysis.household_metadata_job(data, None, offline_provider()) is not job)
+
+    upload = data_load.DataLoad()
+    upload.df, upload.name = data, 'Daniel'
+    scraped = front_page.show_scraped_data(upload, provider=provider)
+    assert (job.collected)
+    key = ['Split Title', 'Series']
+    pd.util.testing.assert_frame_equal(data_analysis.load_saved_metadata().sort_values(key).reset_index(drop=True),
+                                       expected.sort_values(key).reset_index(drop=True), check_dtype=False)
+    expected = read_scraped_result()
+    pd.util.testing.assert_frame_equal(scraped[expected.columns], expected)
+
+
+def test_household_metadata_cached_by_provider():
+    """Cached metadata are found by identity of provider, provider's dump isn't hashed."""
+    data = data_analysis.prepare_data(dataForScraping)
+    provider = offline_provider()
+    metadata = data_analysis.household_metadata(data, None, None, provider)
+    provider.index = {}
+    pd.util.testing.assert_frame_equal(data_analysis.household_metadata(data, None, None, provider), metadata)
+    assert (data_analysis.household_metadata(data, None, None, offline_provider()).equals(metadata))
+    with pytest.raises(TypeError):
+        providers.MetadataProvider()
+
+
+def test_offline_provider(tmp_path):
+    """Metadata from local dump give same result as scraping, no requests are sent."""
+    data = data_analysis.prepare_data(dataForScraping)
+    expected = read_scraped_result()
+    dump = data_analysis.titles_metadata(expected).rename(columns={
+        'Split Title': 'title', 'Series': 'series', 'Year Start': 'year_start', 'Year End': 'year_end',
+        'Genre': 'genres', 'Country From': 'country', 'Actors': 'actors', 'Rating': 'rating'})
+    dump['title'] = dump['title'].str.upper()
+    dump.to_csv(tmp_path / 'dump.csv', index=False)
+    provider = OfflineProvider.from_file(tmp_path / 'dump.csv')
+    data = data_analysis.add_scraped_data(data, 'Daniel', provider=provider)
+    pd.util.testing.assert_frame_equal(data[expected.columns], expected)
+
+    dump.drop(columns='series').to_json(tmp_path / 'dump.json', orient='records', force_ascii=False)
+    provider = OfflineProvider.from_file(tmp_path / 'dump.json')
+    table = provider.lookup(viewing_data_input)
+    assert (list(table.columns) == ['Title', 'Year Start', 'Year End', 'Genre', 'Country', 'Actors', 'Rating'])
+    assert (table.loc[table.Title == 'Superstore', 'Year Start'].iloc[0] == 2015)
+    assert (table.loc[table.Title == 'fasdfa', 'Rating'].iloc[0] == -1)
+
+
+def test_single_flight():
+    """Calls with same key running at the same time are made once."""
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'page'
+
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', slow))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flights.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert (results == ['page'] * 4)
+    assert (flights.stats() == {'calls': 4, 'executions': 1, 'coalesced': 3, 'hits': 0})
+    assert (flights.do('key', lambda: 'new page') == 'new page')
+
+
+def test_single_flight_scrapings():
+    """Scrapings sharing SingleFlight request every page only once."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd', latency=0.02)
+    flights = SingleFlight(ttl=60)
+    scrapers = [ScrapeData(viewing_data_input, requests_per_second=1000, session=session, flights=flights)
+                for _ in range(3)]
+    threads = [threading.Thread(target=scraper.start_scraping) for scraper in scrapers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    for scraper in scrapers:
+        pd.util.testing.assert_frame_equal(scraper.scraped_table, scrape_data_result)
+    assert (session.requests == 17)
+    assert (flights.stats()['coalesced'] + flights.stats()['hits'] == 2 * flights.stats()['executions'])
+
+
+def test_csfd_provider_store(tmp_path, monkeypatch, cache):
+    """Provider opens one store for all lookups and closes it, given store is left open."""
+    opened = []
+
+    def open_store():
+        opened.append(MetadataStore(tmp_path / 'metadata.sqlite'))
+        return opened[-1]
+    monkeypatch.setattr(providers, 'MetadataStore', open_store)
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd')
+    with providers.CsfdProvider(session=session, requests_per_second=1000) as provider:
+        provider.lookup(viewing_data_input)
+        provider.lookup(viewing_data_input)
+    assert (len(opened) == 1 and provider.store is None)
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].get('Superstore', True)
+    given = MetadataStore(tmp_path / 'given.sqlite')
+    with providers.CsfdProvider(given, session=session, requests_per_second=1000) as provider:
+        provider.lookup(viewing_data_input)
+    assert (given.get('Superstore', True) is not None)
+
+
+def test_reparse_from_page_store(tmp_path):
+    """Pages saved during scraping are parsed again without requests, same pages are saved once."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd')
+    pages = PageStore(tmp_path / 'pages')
+    ScrapeData(viewing_data_input, requests_per_second=1000, session=session, page_store=pages).start_scraping()
+    ScrapeData(viewing_data_input, requests_per_second=1000, session=session, page_store=pages).start_scraping()
+    stats = pages.stats()
+    assert (stats['fetches'] == 2 * stats['pages'])
+    assert (stats['compressed_bytes'] < stats['bytes'])
+    scraper = ScrapeData(viewing_data_input, session=NoNetworkSession(), page_store=pages)
+    scraper.reparse_from_store(processes=2)
+    pd.util.testing.assert_frame_equal(scraper.scraped_table, scrape_data_result)
+    assert (scraper.statuses['fasdfa'] == checkpoint.NOT_FOUND)
+
+
+def test_scrape_metrics(tmp_path):
+    """Metrics count every request, phase and title and can be exported."""
+    session = ReplaySession.from_corpus(path + 'tests/data_for_test/csfd')
+    store = MetadataStore(tmp_path / 'metadata.sqlite')
+    scraper = ScrapeData(viewing_data_input, requests_per_second=1000, session=session, store=store)
+    scraper.start_scraping()
+    metrics = scraper.metrics.to_dict()
+    assert (metrics['requests'] == session.requests == sum(metrics['status_codes'].values()))
+    assert (metrics['phases']['search_fetch']['count'] == len(viewing_data_input))
+    assert (metrics['phases']['film_parse']['count'] == metrics['titles']['done'])
+    assert (sum(metrics['titles'].values()) == len(viewing_data_input))
+    assert (metrics['cache']['store'] == {'hit': 0, 'miss': len(viewing_data_input), 'hit_rate': 0.0})
+    assert (metrics['titles_per_second'] > 0)
+    scraper.metrics.write(tmp_path / 'metrics.prom')
+    text = (tmp_path / 'metrics.prom').read_text()
+    assert ('csfd_scrape_phase_seconds_count{phase="search_fetch"} ' + str(len(viewing_data_input)) in text)
+    assert ('csfd_scrape_titles_total{status="not_found"} 1' in text)
+    scraper.metrics.write(tmp_path / 'metrics.json')
+    assert (json.loads((tmp_path / 'metrics.json').read_text())['requests'] == session.requests)